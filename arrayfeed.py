@@ -0,0 +1,180 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import backtrader as bt
+from backtrader.linebuffer import LineBuffer
+from profiling import stage
+
+#Backtrader feed over plain NumPy arrays. OHLCV lives in contiguous float64
+#arrays next to an int64 nanosecond timestamp array; a bundle saved with
+#save() can be reopened memory-mapped, so preload is one bulk copy per line
+#and processes share the same pages (the bundle pickles as its directory).
+
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+NS_PER_DAY = 86400 * 10**9
+#Proleptic ordinal of 1970-01-01, the origin of backtrader date numbers
+EPOCH_ORDINAL = 719163
+
+
+class OHLCV(object):
+
+    def __init__(self, dates, columns, directory=None):
+        self.dates = dates
+        self.columns = columns
+        self.directory = directory
+
+    @classmethod
+    def from_frame(cls, df):
+        """Date-indexed OHLCV DataFrame -> arrays (views when the columns
+        are already float64)."""
+        dates = pd.DatetimeIndex(df.index).values.astype('datetime64[ns]').view(np.int64)
+        columns = dict((col, np.ascontiguousarray(df[col].to_numpy(dtype=np.float64))) for col in FIELDS if col in df.columns)
+        return cls(dates, columns)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        mode = 'r' if mmap else None
+        dates = np.load(os.path.join(directory, 'Date.npy'), mmap_mode=mode)
+        columns = {}
+        for col in FIELDS:
+            path = os.path.join(directory, f'{col}.npy')
+            if os.path.exists(path):
+                columns[col] = np.load(path, mmap_mode=mode)
+        return cls(dates, columns, directory if mmap else None)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'Date.npy'), np.asarray(self.dates, dtype=np.int64))
+        for col, values in self.columns.items():
+            np.save(os.path.join(directory, f'{col}.npy'), np.asarray(values, dtype=np.float64))
+
+    def share(self):
+        """Save to a temporary directory and reopen memory-mapped; remove it
+        with release() once no process needs it."""
+        directory = tempfile.mkdtemp(prefix='ohlcv-')
+        self.save(directory)
+        return OHLCV.load(directory)
+
+    def release(self):
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __reduce__(self):
+        if self.directory is not None:
+            return (OHLCV.load, (self.directory,))
+        return (OHLCV, (np.asarray(self.dates), dict((k, np.asarray(v)) for k, v in self.columns.items())))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    def tail(self, bars):
+        if bars >= len(self):
+            return self
+        return OHLCV(self.dates[-bars:], dict((k, v[-bars:]) for k, v in self.columns.items()))
+
+    def rows(self, start, stop):
+        """Bars [start, stop) by position, as views."""
+        if start <= 0 and stop >= len(self):
+            return self
+        return OHLCV(self.dates[start:stop], dict((k, v[start:stop]) for k, v in self.columns.items()))
+
+    def between(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self.dates, pd.Timestamp(start).value, side='left')
+        hi = len(self) if end is None else np.searchsorted(self.dates, pd.Timestamp(end).value, side='right')
+        if lo == 0 and hi == len(self):
+            return self
+        return OHLCV(self.dates[lo:hi], dict((k, v[lo:hi]) for k, v in self.columns.items()))
+
+    @property
+    def index(self):
+        return pd.DatetimeIndex(np.asarray(self.dates).view('datetime64[ns]'), name='Date')
+
+    def to_frame(self):
+        return pd.DataFrame(dict((k, np.asarray(v)) for k, v in self.columns.items()), index=self.index)
+
+
+def date_numbers(dates):
+    """int64 nanoseconds since the epoch -> backtrader float date numbers."""
+    days, ns = np.divmod(np.asarray(dates, dtype=np.int64), NS_PER_DAY)
+    return (days + EPOCH_ORDINAL).astype(np.float64) + ns / NS_PER_DAY
+
+
+def snap_dates(times, dates):
+    """Datetimes read back from backtrader (float date numbers, off by a few
+    microseconds) -> the nearest of the bundle's int64 `dates`."""
+    dates = np.asarray(dates, dtype=np.int64)
+    times = pd.DatetimeIndex(times).values.astype('datetime64[ns]').view(np.int64)
+    if not len(dates):
+        return pd.DatetimeIndex(times.view('datetime64[ns]'))
+    right = np.clip(np.searchsorted(dates, times), 0, len(dates) - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(np.abs(dates[left] - times) < np.abs(dates[right] - times), left, right)
+    return pd.DatetimeIndex(dates[nearest].view('datetime64[ns]'))
+
+
+def bar_timeframe(dates):
+    """(backtrader timeframe, compression) of the bars: days unless they
+    carry a time of day, else the median bar spacing in minutes (seconds
+    when it is not a whole minute)."""
+    dates = np.asarray(dates, dtype=np.int64)
+    steps = np.diff(dates)
+    steps = steps[steps > 0]
+    if not len(steps) or not (dates % NS_PER_DAY).any():
+        return bt.TimeFrame.Days, 1
+    seconds = max(1, int(round(np.median(steps) / 1e9)))
+    if seconds >= 86400:
+        return bt.TimeFrame.Days, 1
+    if seconds % 60 == 0:
+        return bt.TimeFrame.Minutes, seconds // 60
+    return bt.TimeFrame.Seconds, seconds
+
+
+class ArrayData(bt.feed.DataBase):
+    """Feed whose dataname is an OHLCV bundle. preload() fills every line
+    buffer with one bulk copy; feeds with filters, a timezone or a date
+    range go through the regular per-bar load."""
+
+    def start(self):
+        super(ArrayData, self).start()
+        self._idx = -1
+        self._datenums = date_numbers(self.p.dataname.dates)
+
+    def _bulk(self):
+        return (not self._filters and not self._ffilters and self._tzinput is None
+                and self.fromdate == float('-inf') and self.todate == float('inf')
+                and all(line.mode == LineBuffer.UnBounded for line in self.lines))
+
+    def preload(self):
+        if not self._bulk():
+            return super(ArrayData, self).preload()
+        bundle = self.p.dataname
+        with stage('feed preload'):
+            for alias in self.getlinealiases():
+                line = getattr(self.lines, alias)
+                if alias == 'datetime':
+                    values = self._datenums
+                elif alias.capitalize() in bundle.columns:
+                    values = bundle[alias.capitalize()]
+                else:
+                    values = np.full(len(bundle), np.nan)
+                line.array.frombytes(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        self._idx = len(bundle) - 1
+        self._last()
+        self.home()
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._datenums):
+            return False
+        bundle = self.p.dataname
+        for col, values in bundle.columns.items():
+            getattr(self.lines, col.lower())[0] = values[self._idx]
+        self.lines.datetime[0] = self._datenums[self._idx]
+        return True
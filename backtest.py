@@ -5,176 +5,212 @@ import backtrader as bt
 import numpy as np
 import pandas as pd
 import time
-import streamlit as st
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from ledger import build_equity_ledger, match_trades_fifo
+import vectorized
+from search import make_search
+from resultcache import RESULT_CACHE
+from resultstore import data_key, record_key
+from profiling import stage
+from metrics import EquityRecorder, FinalValueRecorder, headline, metrics_table, performance, total_returns, sharpe_ratio, drawdown_stats, bar_returns, exposure_time
+from datacache import MarketDataCache
+from arrayfeed import OHLCV, ArrayData, bar_timeframe, snap_dates
+from timeframes import add_levels, parse_rules
 
 riskfree_annual = 0.01
 trading_days_per_year = 365
 daily_return = (1 + riskfree_annual) ** (1 / trading_days_per_year) - 1
 
-def run_backtest(Strategy, df, cash, qty, cheating, resampling, optimized=False, best_params_dict=None):
-    cerebro = bt.Cerebro()
+def make_feed(data):
+    """Backtrader feed over a date-indexed OHLCV DataFrame or an OHLCV bundle,
+    with the timeframe of its bars (intraday bars are not bucketed per day)."""
+    bundle = data if isinstance(data, OHLCV) else OHLCV.from_frame(data)
+    timeframe, compression = bar_timeframe(bundle.dates)
+    return ArrayData(dataname=bundle, timeframe=timeframe, compression=compression)
+
+
+#Analyzers attached per analysis profile. 'full' keeps the observers and every
+#per-bar record used by the chart; 'summary' only records the equity curve and
+#fills and computes its table with the metrics module; 'minimal' only keeps the
+#final value (no per-bar work) for the headline return rows.
+ANALYZERS = {
+    'positionsvalue': (bt.analyzers.PositionsValue, {}),
+    'sharpe': (bt.analyzers.SharpeRatio, {'timeframe': bt.TimeFrame.Days, 'riskfreerate': daily_return}),
+    'drawdown': (bt.analyzers.DrawDown, {}),
+    'returns': (bt.analyzers.Returns, {'timeframe': bt.TimeFrame.Days}),
+    'trades': (bt.analyzers.TradeAnalyzer, {}),
+    'sqn': (bt.analyzers.SQN, {}),
+    'transactions': (bt.analyzers.Transactions, {}),
+    'timereturn': (bt.analyzers.TimeReturn, {}),
+    'calmar': (bt.analyzers.Calmar, {}),
+    'equity': (EquityRecorder, {}),
+    'final': (FinalValueRecorder, {}),
+}
+
+ANALYSIS_PROFILES = {
+    'full': ('positionsvalue', 'sharpe', 'drawdown', 'returns', 'trades', 'sqn', 'transactions', 'timereturn', 'calmar'),
+    'summary': ('equity',),
+    'minimal': ('final',),
+}
+
+#Performance table rows per profile (None: all of them)
+PROFILE_METRICS = {
+    'full': None,
+    'summary': None,
+    'minimal': ('START', 'END', 'DURATION', 'EQUITY FINAL [IDR]', 'RETURN [%]', 'BUY & HOLD RETURN [%]',
+                'RETURN (ANN.) [%]'),
+}
+
+
+def run_cerebro(Strategy, df, cash, qty, cheating, optimized=False, best_params_dict=None, profile='full'):
+    names = ANALYSIS_PROFILES[profile]
+    cerebro = bt.Cerebro(stdstats=profile=='full')
     if optimized==False:
         cerebro.addstrategy(Strategy)
     else:
         cerebro.addstrategy(Strategy, **best_params_dict)  
 
-    data = bt.feeds.PandasData(dataname=df)
+    with stage('feed build'):
+        data = make_feed(df)
     cerebro.adddata(data)
-    if resampling==True:
-        cerebro.resampledata(data, timeframe=bt.TimeFrame.Months)
-    else:
-        pass
-    
+    bar_dates = data.p.dataname.dates
+
     # Set desired initial capital
     cerebro.broker.setcash(cash)
     cerebro.addsizer(bt.sizers.FixedSize, stake=qty)
     #cerebro.broker.setcommission(commission=0)
 
-    cerebro.addobserver(bt.observers.DrawDown)
-    cerebro.addobserver(bt.observers.TimeReturn)
+    if profile=='full':
+        cerebro.addobserver(bt.observers.DrawDown)
+        cerebro.addobserver(bt.observers.TimeReturn)
 
-    if resampling==False:
-        cerebro.addanalyzer(bt.analyzers.PositionsValue, _name='positionsvalue')
-    else:
-        pass
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', timeframe=bt.TimeFrame.Days, riskfreerate=daily_return)
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')  
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')  
-    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')   
-    cerebro.addanalyzer(bt.analyzers.SQN, _name='sqn')
-    cerebro.addanalyzer(bt.analyzers.Transactions, _name='transactions') 
-    cerebro.addanalyzer(bt.analyzers.TimeReturn, _name='timereturn') 
-    cerebro.addanalyzer(bt.analyzers.Calmar, _name='calmar')
-
-    thestrats = cerebro.run(cheat_on_open=cheating)
-    thestrat = thestrats[0]
-    if resampling==False:
-        positionsvalue = thestrat.analyzers.positionsvalue.get_analysis()
-    else:
-        pass
+    for name in names:
+        analyzer, kwargs = ANALYZERS[name]
+        cerebro.addanalyzer(analyzer, _name=name, **kwargs)
 
-    sharpe = thestrat.analyzers.sharpe.get_analysis()  
-    drawdown = thestrat.analyzers.drawdown.get_analysis()  
-    returns = thestrat.analyzers.returns.get_analysis()  
-    trades = thestrat.analyzers.trades.get_analysis()  
-    sqn = thestrat.analyzers.sqn.get_analysis() 
-    transactions = thestrat.analyzers.transactions.get_analysis() 
-    timereturn = thestrat.analyzers.timereturn.get_analysis()  
-    calmar = thestrat.analyzers.calmar.get_analysis()  
+    with stage('cerebro run'):
+        thestrats = cerebro.run(cheat_on_open=cheating)
+    with stage('analyzer extraction'):
+        thestrat = thestrats[0]
+        analyses = dict((name, getattr(thestrat.analyzers, name).get_analysis()) for name in names)
 
-    #cerebro.plot()
+        #cerebro.plot()
 
-    try:
-        indicators_df = pd.DataFrame(thestrat.indicator_values)
-        indicators_df.columns = indicators_df.iloc[0]  
-        indicators_df = indicators_df[1:].reset_index(drop=True).dropna(axis=1, how='all')
-    except:
-        indicators_df = 'No indicators'
-    try:
-        indicators_df = indicators_df.drop(columns=['fromopen']) 
-    except:
-        pass
-    if resampling==True and isinstance(indicators_df, pd.DataFrame) and not indicators_df.empty:  
-        indicators_df = indicators_df.drop(columns=['support1','resistance1','high_price','low_price','pp_val']).dropna()
-        indicators_df['datetime'] = pd.to_datetime(indicators_df['datetime'])
-        indicators_df = df.reset_index()[['Date']].merge(indicators_df, how='left',left_on='Date', right_on='datetime')
-        indicators_df = indicators_df[['Date','support2','resistance2']].rename(columns={'Date':'datetime'}).fillna(0).sort_values('datetime',ascending=True).drop_duplicates(subset='datetime',keep='first').reset_index(drop=True)
-    else:
-        pass
+        try:
+            indicators_df = thestrat.indicators_frame().dropna(axis=1, how='all')
+        except:
+            indicators_df = 'No indicators'
+        try:
+            indicators_df = indicators_df.drop(columns=['fromopen']) 
+        except:
+            pass
 
-    timereturn_df = pd.DataFrame(list(timereturn.items()), columns=['Date', 'Value'])
-    calmar_df = pd.DataFrame.from_dict(calmar, orient='index', columns=['Value']).reset_index()
+        timereturn_df = calmar_df = transaction_df = position_df = None
+        if 'timereturn' in analyses:
+            timereturn_df = pd.DataFrame(list(analyses['timereturn'].items()), columns=['Date', 'Value'])
+            timereturn_df['Date'] = snap_dates(timereturn_df['Date'], bar_dates)
+        if 'calmar' in analyses:
+            calmar_df = pd.DataFrame.from_dict(analyses['calmar'], orient='index', columns=['Value']).reset_index()
     
-    data = []  
-    for date, value in transactions.items():  
-        for item in value:  
-            data.append([date] + item)  
-    columns = ['date', 'amount', 'price', 'sid', 'symbol', 'value'] 
-    transaction_df = pd.DataFrame(data, columns=columns)
-    transaction_df['signal'] = np.where(transaction_df['amount']<0 & np.array(transaction_df['amount']>0),'sell','buy')
-
-    if resampling==False:
-        position_df = pd.DataFrame.from_dict(positionsvalue, orient='index', columns=['Value']).reset_index()
-        position_df['index'] = pd.to_datetime(position_df['index'])  
-    else:
-        position_df = transaction_df[['date','amount','signal']].merge(df.reset_index()[['Date','Close']].rename(columns={'Date':'date'}), on='date', how='outer').sort_values('date',ascending=True).reset_index(drop=True)
-        position_df['amount'] = position_df['amount'].ffill().fillna(0).clip(lower=0)  
-        position_df['Value'] = position_df['amount']*position_df['Close']
-        position_df = position_df.rename(columns={'date':'index'}).drop(columns={'signal','amount'})
+        if 'transactions' in analyses:
+            data = []  
+            for date, value in analyses['transactions'].items():  
+                for item in value:  
+                    data.append([date] + item)  
+            columns = ['date', 'amount', 'price', 'sid', 'symbol', 'value'] 
+            transaction_df = pd.DataFrame(data, columns=columns)
+            transaction_df['date'] = snap_dates(transaction_df['date'], bar_dates)
+            transaction_df['signal'] = np.where(transaction_df['amount']<0 & np.array(transaction_df['amount']>0),'sell','buy')
+
+        if 'positionsvalue' in analyses:
+            position_df = pd.DataFrame.from_dict(analyses['positionsvalue'], orient='index', columns=['Value']).reset_index()
+            position_df['index'] = snap_dates(position_df['index'], bar_dates)
+
+    return {
+        'sharpe': analyses.get('sharpe'),
+        'drawdown': analyses.get('drawdown'),
+        'returns': analyses.get('returns'),
+        'trades': analyses.get('trades'),
+        'sqn': analyses.get('sqn'),
+        'equity': analyses.get('equity') or analyses.get('final'),
+        'value': cerebro.broker.getvalue(),
+        'indicators_df': indicators_df,
+        'timereturn_df': timereturn_df,
+        'calmar_df': calmar_df,
+        'transaction_df': transaction_df,
+        'position_df': position_df,
+    }
+
+
+def run_backtest(Strategy, df, cash, qty, cheating, resampling, optimized=False, best_params_dict=None, engine='backtrader', cache=True, profile='full'):
+    """`profile` picks the analyzers from ANALYSIS_PROFILES. Outputs the
+    profile does not collect are None and their metrics are left out of the
+    performance table. `resampling` names higher timeframes ('W', 'M', ...)
+    whose pivot levels are added to the indicators as support2_M, ...; True
+    adds the monthly ones as support2/resistance2 like before. `df` is
+    a date-indexed OHLCV DataFrame or an arrayfeed.OHLCV bundle."""
+    if profile not in ANALYSIS_PROFILES:
+        raise ValueError(f"Unknown analysis profile {profile}. Expected one of {list(ANALYSIS_PROFILES)}.")
+    with stage('backtest'):
+        if not cache:
+            return compute_backtest(Strategy, df, cash, qty, cheating, resampling, optimized, best_params_dict, engine, profile)
+        params = get_params(Strategy)
+        if optimized==True:
+            params.update(best_params_dict)
+        key = (data_key(df), Strategy.__module__, Strategy.__name__, tuple(sorted(params.items())),
+               cash, qty, bool(cheating), resampling is True or parse_rules(resampling), engine, profile)
+        return RESULT_CACHE.get_or_compute(key, lambda: compute_backtest(Strategy, df, cash, qty, cheating, resampling, optimized, best_params_dict, engine, profile))
+
+
+def compute_backtest(Strategy, df, cash, qty, cheating, resampling, optimized=False, best_params_dict=None, engine='backtrader', profile='full'):
+    analysis = None
+    if engine=='numpy' and vectorized.supports(Strategy):
+        params = get_params(Strategy)
+        if optimized==True:
+            params.update(best_params_dict)
+        with stage('numpy engine'):
+            analysis = vectorized.run_strategy(Strategy, df, cash, qty, params, daily_return)
+    if analysis is None:
+        with stage('backtrader'):
+            analysis = run_cerebro(Strategy, df, cash, qty, cheating, optimized, best_params_dict, profile)
+    if resampling:
+        #Higher-timeframe pivot levels, looked up from the cached bars
+        with stage('higher timeframes'):
+            analysis['indicators_df'] = add_levels(analysis['indicators_df'], df, resampling)
+
+    if profile!='full':
+        #Table straight from the equity curve and fills, no per-bar frames
+        with stage('metrics'):
+            equity = analysis['equity']
+            close = np.asarray(df['Close'], dtype=float)
+            if profile=='minimal':
+                final = equity['final'] if 'final' in equity else equity['value'][-1]
+                return metrics_table(headline(equity['dates'], final, cash, close, PROFILE_METRICS[profile])), None, None, None, None, None, analysis['indicators_df']
+            try:
+                performance_metrics = metrics_table(performance(equity['dates'], equity['value'], cash, equity['fill_idx'], equity['amount'],
+                                                                equity['price'], close, daily_return, PROFILE_METRICS[profile]))
+            except:
+                performance_metrics = 'no trades'
+        return performance_metrics, None, None, None, None, None, analysis['indicators_df']
+
+    sharpe = analysis['sharpe']
+    drawdown = analysis['drawdown']
+    returns = analysis['returns']
+    trades = analysis['trades']
+    sqn = analysis['sqn']
+    indicators_df = analysis['indicators_df']
+    timereturn_df = analysis['timereturn_df']
+    calmar_df = analysis['calmar_df']
+    transaction_df = analysis['transaction_df']
+    position_df = analysis['position_df']
+    close = np.asarray(df['Close'], dtype=float)
 
     equity_df = position_df.merge(transaction_df[['date','price','amount','signal']], how='left', left_on='index', right_on='date').drop(columns={'date'})
     try:
-        #Calculate the cash throughout trades
-        try:
-            buy_index = equity_df[equity_df['signal'] == 'buy'].index[0]  
-            equity_df.loc[buy_index, 'price'] = equity_df.loc[buy_index, 'price'].ffill()  
-        except:
-            pass
-        try:
-            sell_index = equity_df[equity_df['signal'] == 'sell'].index[0]  
-            equity_df.loc[sell_index, 'price'] = equity_df.loc[sell_index, 'price'].ffill()  
-        except:
-            pass  
-
-        print(equity_df.info())
-        equity_df['cash'] = cash
-        for i in range(1, len(equity_df)):
-            equity_df.iloc[i, equity_df.columns.get_loc('cash')] = equity_df.iloc[i - 1, equity_df.columns.get_loc('cash')]
-            if (
-                equity_df.iloc[i, equity_df.columns.get_loc('signal')] == 'buy'
-                and not pd.isna(equity_df.iloc[i, equity_df.columns.get_loc('price')])
-            ):
-                equity_df.iloc[i, equity_df.columns.get_loc('cash')] -= (
-                    equity_df.iloc[i, equity_df.columns.get_loc('price')]
-                    * equity_df.iloc[i, equity_df.columns.get_loc('amount')]
-                )
-
-            elif (
-                equity_df.iloc[i, equity_df.columns.get_loc('signal')] == 'sell'
-                and not pd.isna(equity_df.iloc[i, equity_df.columns.get_loc('price')])
-            ):
-                equity_df.iloc[i, equity_df.columns.get_loc('cash')] += (
-                    equity_df.iloc[i, equity_df.columns.get_loc('price')]
-                    * abs(equity_df.iloc[i, equity_df.columns.get_loc('amount')])
-                )
-
-        
-        #Calculate the equity
-        equity_df.set_index('index', inplace=True)  
-        cash_ = equity_df.iloc[0]['cash']
-        holdings = 0  
-        equity_list = []  
-        equity_df['current_return'] = None
-        last_buy_price = None
-        last_buy_amount = None
-        for idx, row in equity_df.iterrows():  
-            if row['signal'] == 'buy' and not pd.isna(row['amount']):  
-                holdings += row['amount']  
-                cash_ -= row['amount'] * row['price']  
-                last_buy_price = row['price']  
-                last_buy_amount = row['amount']
-            elif row['signal'] == 'sell' and not pd.isna(row['amount']):  
-                holdings += row['amount']  
-                cash_ -= row['amount'] * row['price'] 
-                if last_buy_price is not None and last_buy_amount is not None:
-                    current_value = row['price'] * -row['amount']
-                    equity_df.at[idx, 'current_return'] = ((current_value - (last_buy_price * last_buy_amount)) 
-                                                            / (last_buy_price * last_buy_amount)) * 100
-                last_buy_price = None
-                last_buy_amount = None
-            
-            if last_buy_price is not None and not pd.isna(row['Value']):                
-                current_value = row['Value']  
-                equity_df.at[idx, 'current_return'] = ((current_value - (last_buy_price * last_buy_amount)) / (last_buy_price * last_buy_amount)) * 100
-            
-            equity = cash_ + row['Value']  
-            equity_list.append(equity)  
-        equity_df['equity'] = equity_list  
-        equity_df = equity_df.reset_index()
-
-        #Calculate the drawdown
-        equity_df['peak_equity'] = equity_df['equity'].cummax()  
-        equity_df['drawdown'] = ((equity_df['equity'] - equity_df['peak_equity']) / equity_df['peak_equity'])*(100)
+        #Calculate cash, holdings, equity and drawdown
+        with stage('equity ledger'):
+            equity_df = build_equity_ledger(equity_df, cash)
 
         #Calculate expectancy %
         win_rate = trades['won']['total'] / trades['total']['closed']
@@ -186,52 +222,9 @@ def run_backtest(Strategy, df, cash, qty, cheating, resampling, optimized=False,
     
     #Transform transactions data to trades transaction log
     try:
-        # Initialize lists to store the results  
-        sizes = []  
-        entry_prices = []  
-        exit_prices = []  
-        pnls = []  
-        return_pcts = []  
-        entry_times = []  
-        exit_times = []  
-        durations = []
-        
-        # Iterate through the DataFrame to find pairs of 'buy' and 'sell' signals  
-        for i in range(0, len(transaction_df), 2):  
-            if i+1 < len(transaction_df):  
-                entry_row = transaction_df.iloc[i]  
-                exit_row = transaction_df.iloc[i+1]  
-                
-                size = entry_row['amount']  
-                entry_price = entry_row['price']  
-                exit_price = exit_row['price']  
-                pnl = exit_price - entry_price  
-                return_pct = ((exit_price - entry_price) / entry_price) * 100  
-                entry_time = entry_row['date']  
-                exit_time = exit_row['date']  
-                duration = exit_time - entry_time  
-                
-                sizes.append(size)  
-                entry_prices.append(entry_price)  
-                exit_prices.append(exit_price)  
-                pnls.append(pnl)  
-                return_pcts.append(return_pct)  
-                entry_times.append(entry_time)  
-                exit_times.append(exit_time)  
-                durations.append(duration)  
-        
-        # Create the output DataFrame  
-        trades_df = pd.DataFrame({  
-            'Size': sizes,  
-            'EntryPrice': entry_prices,  
-            'ExitPrice': exit_prices,  
-            'PnL': pnls,  
-            'ReturnPct': return_pcts,  
-            'EntryTime': entry_times,  
-            'ExitTime': exit_times,  
-            'Duration': durations 
-        })  
-        
+        with stage('trade pairing'):
+            trades_df = match_trades_fifo(transaction_df['amount'].to_numpy(), transaction_df['price'].to_numpy(), transaction_df['date'].to_numpy())
+
         if trades['lost']['pnl']['total'] != 0:  
             profit_factor = trades['won']['pnl']['total'] / abs(trades['lost']['pnl']['total'])
         else:  
@@ -239,53 +232,44 @@ def run_backtest(Strategy, df, cash, qty, cheating, resampling, optimized=False,
     except:
         pass
 
-    #Performance metrics
-    try:
-        data = {  
-            'START': position_df['index'].min(),  
-            'END': position_df['index'].max(),  
-            'DURATION': position_df['index'].max() - position_df['index'].min(),
-            'EXPOSURE TIME [%]': (trades['len']['total']/(position_df['index'].max() - position_df['index'].min()).days)*100, #hanya closed trades?
-            'EQUITY FINAL [IDR]': cerebro.broker.getvalue(), 
-            'EQUITY PEAK [IDR]': equity_df['peak_equity'].max(),  
-            'RETURN [%]': returns['rtot']*100,  
-            'BUY & HOLD RETURN [%]': ((df['Close'].iloc[-1] - df['Close'].iloc[0])/df['Close'].iloc[0])*100, 
-            'RETURN (ANN.) [%]': returns['rnorm100'],  
-            'RETURN VOLATILITY [%]': (timereturn_df[timereturn_df['Value'] > 0]['Value'].std() * 100),  
-            'SHARPE RATIO': sharpe['sharperatio'],  
-            'CALMAR RATIO (BACKTRADER)': calmar_df['Value'].iloc[-1],
-            'CALMAR RATIO': returns['rnorm100']/drawdown['max']['drawdown'] if drawdown['max']['drawdown'] != 0 else float('inf'),  
-            'MAX. DRAWDOWN [%]': drawdown['max']['drawdown'],  
-            'AVG. DRAWDOWN [%]': drawdown['drawdown'],  
-            'MAX. DRAWDOWN DURATION': drawdown['max']['len'],  
-            'AVG. DRAWDOWN DURATION': drawdown['len'],  
-            'TOTAL TRADES': trades['total']['total'],  
-            'WIN RATE [%]': (trades['won']['total'] / trades['total']['closed']) * 100,
-            'BEST TRADE RETURN [%]': trades_df['ReturnPct'].max(),  
-            'WORST TRADE RETURN [%]': trades_df['ReturnPct'].min(), 
-            'AVG. TRADE RETURN [%]': trades_df['ReturnPct'].mean(), 
-            'MAX. TRADE DURATION': trades['len']['max'], # 
-            'AVG. TRADE DURATION': trades['len']['average'],  
-            'PROFIT FACTOR': profit_factor,  
-            'EXPECTANCY RETURN': expectancy,
-            'SQN': sqn['sqn']  
-        }  
-        performance_metrics = pd.DataFrame(list(data.items()), columns=['metric', 'value'])  
-        rows_to_format = [  
-                'EXPOSURE TIME [%]', 'RETURN [%]','BUY & HOLD RETURN [%]', 'RETURN (ANN.) [%]', 'RETURN VOLATILITY [%]',  
-                'SHARPE RATIO', 'CALMAR RATIO', 'MAX. DRAWDOWN [%]',  
-                'AVG. DRAWDOWN [%]', 'WIN RATE [%]', 'BEST TRADE RETURN [%]',  
-                'WORST TRADE RETURN [%]', 'AVG. TRADE RETURN [%]', 'PROFIT FACTOR',  
-                'EXPECTANCY RETURN', 'SQN'
-                    ]  
-
-        performance_metrics['value'] = performance_metrics.apply(lambda x: round(float(x['value']), 5) if x['metric'] in rows_to_format else x['value'],  axis=1)    
-        performance_metrics = performance_metrics
-    except:
-        #trades_df = 'no trades'
-        performance_metrics = 'no trades'
-        #transaction_df = 'no trades'
-        #position_df = 'no trades'
+    with stage('metrics'):
+        #Performance metrics
+        try:
+            data = {  
+                'START': position_df['index'].min(),  
+                'END': position_df['index'].max(),  
+                'DURATION': position_df['index'].max() - position_df['index'].min(),
+                'EXPOSURE TIME [%]': exposure_time(trades['len']['total'], position_df['index']), #hanya closed trades?
+                'EQUITY FINAL [IDR]': analysis['value'], 
+                'EQUITY PEAK [IDR]': equity_df['peak_equity'].max(),  
+                'RETURN [%]': returns['rtot']*100,  
+                'BUY & HOLD RETURN [%]': ((close[-1] - close[0])/close[0])*100, 
+                'RETURN (ANN.) [%]': returns['rnorm100'],  
+                'RETURN VOLATILITY [%]': (timereturn_df[timereturn_df['Value'] > 0]['Value'].std() * 100),  
+                'SHARPE RATIO': sharpe['sharperatio'],  
+                'CALMAR RATIO (BACKTRADER)': calmar_df['Value'].iloc[-1],
+                'CALMAR RATIO': returns['rnorm100']/drawdown['max']['drawdown'] if drawdown['max']['drawdown'] != 0 else float('inf'),  
+                'MAX. DRAWDOWN [%]': drawdown['max']['drawdown'],  
+                'AVG. DRAWDOWN [%]': drawdown['drawdown'],  
+                'MAX. DRAWDOWN DURATION': drawdown['max']['len'],  
+                'AVG. DRAWDOWN DURATION': drawdown['len'],  
+                'TOTAL TRADES': trades['total']['total'],  
+                'WIN RATE [%]': (trades['won']['total'] / trades['total']['closed']) * 100,
+                'BEST TRADE RETURN [%]': trades_df['ReturnPct'].max(),  
+                'WORST TRADE RETURN [%]': trades_df['ReturnPct'].min(), 
+                'AVG. TRADE RETURN [%]': trades_df['ReturnPct'].mean(), 
+                'MAX. TRADE DURATION': trades['len']['max'], # 
+                'AVG. TRADE DURATION': trades['len']['average'],  
+                'PROFIT FACTOR': profit_factor,  
+                'EXPECTANCY RETURN': expectancy,
+                'SQN': sqn['sqn']  
+            }  
+            performance_metrics = metrics_table(data)
+        except:
+            #trades_df = 'no trades'
+            performance_metrics = 'no trades'
+            #transaction_df = 'no trades'
+            #position_df = 'no trades'
     return performance_metrics, trades_df, transaction_df, position_df, timereturn_df, equity_df, indicators_df
 
 
@@ -295,44 +279,339 @@ def get_params(strategy_class):
 
 
 #optimize backtesting
-def run_optimizer(Strategy, df, cash, qty, strategy_params):
-    data = bt.feeds.PandasData(dataname=df)  
-    crbr_opt = bt.Cerebro() 
-    crbr_opt.optstrategy(Strategy, **strategy_params)  
-    crbr_opt.adddata(data)  
-    crbr_opt.broker.set_cash(cash) 
-    crbr_opt.addsizer(bt.sizers.FixedSize, stake=qty)
-
-    # Add analyzers  
-    crbr_opt.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')  
-    crbr_opt.addanalyzer(bt.analyzers.Returns, _name='returns')  
-    crbr_opt.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe', timeframe=bt.TimeFrame.Days, riskfreerate=daily_return)
-
-    start_time = time.time()  
-    # Run optimization  
-    optimized_runs = crbr_opt.run(maxcpus=1)  
-    end_time = time.time()  
-    st.info(f"Optimization took {end_time - start_time} seconds")  
-
-    # Collect results  
-    results_list = []
-    for run in optimized_runs:  
-        for strategy in run:  
-            params = get_params(strategy)
-            sharpe_analyzer = strategy.analyzers.sharpe.get_analysis()  
-            returns_analyzer = strategy.analyzers.returns.get_analysis()  
-            drawdown_analyzer = strategy.analyzers.drawdown.get_analysis()  
-            
-            result_dict = {  
-                    'strategy': params,
-                    'sharpe_ratio': sharpe_analyzer['sharperatio'],  
-                    'returns (%)': returns_analyzer['rtot']*100,  
-                    'max_drawdown (%)': drawdown_analyzer['max']['drawdown']  
-                }  
-            results_list.append(result_dict)  
-    results_df = pd.DataFrame(results_list) 
-    results_df = results_df.sort_values('returns (%)',ascending=False).reset_index(drop=True)
-    best_params = results_df['strategy'].iloc[0]
-    best_params_dict = {key: value for key, value in best_params.items()}  
-    st.success(f'\n Best parameter: {best_params_dict}')
-    return results_df, best_params_dict
\ No newline at end of file
+def cerebro_equity(Strategy, df, cash, qty, params):
+    """(strategy instance, broker value per bar) of a bare cerebro run."""
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(Strategy, **params)
+    cerebro.adddata(make_feed(df))
+    cerebro.broker.set_cash(cash)
+    cerebro.addsizer(bt.sizers.FixedSize, stake=qty)
+    cerebro.addanalyzer(EquityRecorder, _name='equity')
+    strategy = cerebro.run()[0]
+    return strategy, strategy.analyzers.equity.get_analysis()['value']
+
+
+def evaluate_cerebro(Strategy, df, cash, qty, params):
+    strategy, value = cerebro_equity(Strategy, df, cash, qty, params)
+    return {
+            'strategy': get_params(strategy),
+            'sharpe_ratio': sharpe_ratio(bar_returns(value, cash), daily_return)['sharperatio'],
+            'returns (%)': total_returns(value, cash)['rtot']*100,
+            'max_drawdown (%)': drawdown_stats(value)['max']['drawdown']
+        }
+
+
+def evaluate_params(Strategy, df, cash, qty, params, engine='backtrader'):
+    record = None
+    if engine=='numpy' and vectorized.supports(Strategy):
+        record = vectorized.evaluate(Strategy, df, cash, qty, params, daily_return)
+    if record is None:
+        record = evaluate_cerebro(Strategy, df, cash, qty, params)
+    return record
+
+
+#Worker state: a memory-mapped OHLCV bundle, opened once per process by the pool initializer
+_worker_df = None
+
+def _init_optimizer_worker(data):
+    global _worker_df
+    _worker_df = data
+
+def _evaluate_chunk(task):
+    Strategy, cash, qty, chunk, engine, bars = task
+    window = _worker_df if bars == len(_worker_df) else _worker_df.tail(bars)
+    return [evaluate_params(Strategy, window, cash, qty, params, engine) for params in chunk]
+
+
+def iter_optimizer(Strategy, df, cash, qty, strategy_params, engine='backtrader', workers=1, search='grid', budget=None, seed=None, store=None):
+    """Yield each full-range result record as soon as it is evaluated.
+    `search` picks the strategy from search.SEARCH_MODES; evaluations on
+    partial windows (successive halving) only feed the search. Closing the
+    generator early cancels combinations not yet started. With a
+    resultstore.ResultStore, combinations stored earlier are served from it
+    first and only the others are evaluated (and stored); yielded records
+    then carry 'stored' (True when served from the store)."""
+    workers = max(1, workers or os.cpu_count() or 1)
+    searcher = make_search(search, strategy_params, budget=budget, seed=seed, batch_size=workers)
+    defaults = get_params(Strategy)
+    executor = None
+    shared = None
+    windows = {}
+    fresh = []
+    if workers > 1:
+        #Workers map the same array files instead of unpickling a DataFrame each
+        with stage('share data'):
+            shared = OHLCV.from_frame(df).share()
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_optimizer_worker, initargs=(shared,))
+    try:
+        while True:
+            combos, fraction = searcher.ask()
+            if not combos:
+                break
+            combos = [dict(defaults, **combo) for combo in combos]
+            bars = max(1, int(round(len(df) * fraction)))
+            window = df if bars == len(df) else df.tail(bars)
+            keys = [None] * len(combos)
+            stored = {}
+            if store is not None:
+                with stage('result store'):
+                    if bars not in windows:
+                        windows[bars] = data_key(window)
+                    keys = [record_key(windows[bars], Strategy, params, cash, qty, engine, daily_return) for params in combos]
+                    stored = store.get_many(keys)
+            todo = [(key, params) for key, params in zip(keys, combos) if key not in stored]
+            records = []
+            if executor is None or not todo:
+                batch = ((key, evaluate_params(Strategy, window, cash, qty, params, engine)) for key, params in todo)
+            else:
+                #A few contiguous chunks per worker: balanced without per-combination IPC,
+                #and neighbouring combinations share indicators in the worker's cache
+                size = -(-len(todo) // min(len(todo), workers * 4))
+                futures = dict((executor.submit(_evaluate_chunk, (Strategy, cash, qty, [params for _, params in todo[i:i + size]], engine, bars)),
+                                [key for key, _ in todo[i:i + size]]) for i in range(0, len(todo), size))
+                batch = ((key, record) for future in as_completed(futures) for key, record in zip(futures[future], future.result()))
+            for record in stored.values():
+                records.append(record)
+                if bars == len(df):
+                    yield dict(record, stored=True)
+            for key, record in batch:
+                records.append(record)
+                if store is not None:
+                    fresh.append((key, record))
+                if bars == len(df):
+                    yield record if store is None else dict(record, stored=False)
+            if store is not None:
+                #The search sees the batch in its own order, stored or not
+                evaluated = dict(fresh)
+                records = [stored[key] if key in stored else evaluated[key] for key in keys]
+                store.put_many(fresh)
+                fresh = []
+            searcher.tell(records)
+    finally:
+        if fresh:
+            #Keep what was evaluated before an early stop
+            store.put_many(fresh)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if shared is not None:
+            shared.release()
+
+
+def count_combinations(strategy_params):
+    total = 1
+    for values in strategy_params.values():
+        total *= len(values)
+    return total
+
+
+def run_optimizer(Strategy, df, cash, qty, strategy_params, engine='backtrader', workers=1, time_budget=None, on_result=None, search='grid', budget=None, seed=None, store=None):
+    """Evaluate the search over strategy_params and return (results sorted by
+    return, best params). A time budget stops the search early; compare
+    len(results) with the on_result total to tell. With a `store` (e.g.
+    resultstore.RESULT_STORE) records are kept across runs and the results'
+    'stored' column flags the ones this run did not evaluate."""
+    total = make_search(search, strategy_params, budget=budget).total
+    with stage('optimizer'):
+        with stage('evaluate'):
+            start_time = time.time()  
+            results_list = []
+            results = iter_optimizer(Strategy, df, cash, qty, strategy_params, engine, workers, search, budget, seed, store)
+            for record in results:
+                results_list.append(record)
+                if on_result is not None:
+                    on_result(record, len(results_list), total)
+                if time_budget and time.time() - start_time > time_budget and len(results_list) < total:
+                    results.close()
+                    break
+        with stage('results'):
+            results_df = pd.DataFrame(results_list) 
+            results_df = results_df.sort_values('returns (%)',ascending=False).reset_index(drop=True)
+            best_params = results_df['strategy'].iloc[0]
+            best_params_dict = {key: value for key, value in best_params.items()}  
+        return results_df, best_params_dict
+
+#Universe batch: every worker reads its tickers from the shared data cache
+_worker_market_data = None
+
+def _init_universe_worker(market_data):
+    global _worker_market_data
+    _worker_market_data = market_data
+
+def _backtest_ticker(task):
+    ticker, Strategy, cash, qty, params, start, end, engine, refresh, detail, profile = task
+    row = {'ticker': ticker}
+    try:
+        if hasattr(_worker_market_data, 'arrays'):
+            #Memory-mapped snapshot of the cached history, no DataFrame round trip
+            df = _worker_market_data.arrays(ticker, start, end, refresh=refresh)
+        else:
+            df = _worker_market_data.history(ticker, start, end, refresh=refresh)
+            df = df.set_index('Date') if not df.empty else None
+        if df is None or not len(df):
+            row['error'] = 'no data'
+            return row, None
+        result = run_backtest(Strategy, df, cash, qty, False, False, optimized=bool(params),
+                              best_params_dict=params, engine=engine, cache=False, profile=profile)
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+        return row, None
+    row['bars'] = len(df)
+    performance_metrics = result[0]
+    if isinstance(performance_metrics, pd.DataFrame):
+        row.update(zip(performance_metrics['metric'], performance_metrics['value']))
+    else:
+        row['error'] = performance_metrics
+    return row, (result if detail else None)
+
+
+def iter_universe(Strategy, tickers, cash, qty, params=None, start=None, end=None, market_data=None,
+                  engine='backtrader', workers=None, refresh=True, detail=False, profile=None):
+    """Yield (summary row, detail) per ticker as each backtest finishes. Only
+    a few tickers per worker are in flight, so memory stays bounded by the
+    summaries kept by the caller; detail is the full run_backtest result when
+    asked for, otherwise None. The analysis profile defaults to 'full' with
+    detail and 'summary' without."""
+    profile = profile or ('full' if detail else 'summary')
+    market_data = market_data if market_data is not None else MarketDataCache()
+    workers = max(1, workers or os.cpu_count() or 1)
+    tasks = ((ticker, Strategy, cash, qty, params, start, end, engine, refresh, detail, profile) for ticker in tickers)
+    if workers == 1:
+        _init_universe_worker(market_data)
+        for task in tasks:
+            yield _backtest_ticker(task)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_universe_worker, initargs=(market_data,))
+    try:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(_backtest_ticker, task))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_universe(Strategy, tickers, cash, qty, params=None, start=None, end=None, market_data=None,
+                 engine='backtrader', workers=None, refresh=True, detail=False, rank_by='RETURN [%]', on_result=None, profile=None):
+    """Backtest one strategy over many tickers. Returns a metrics table with
+    one row per ticker ranked by `rank_by` (failed tickers last, with an
+    error column) and a dict of full results per ticker when detail=True."""
+    tickers = list(dict.fromkeys(tickers))
+    rows = []
+    details = {}
+    for row, result in iter_universe(Strategy, tickers, cash, qty, params, start, end, market_data,
+                                     engine, workers, refresh, detail, profile):
+        rows.append(row)
+        if result is not None:
+            details[row['ticker']] = result
+        if on_result is not None:
+            on_result(row, len(rows), len(tickers))
+
+    results_df = pd.DataFrame(rows)
+    if rank_by in results_df.columns:
+        results_df[rank_by] = pd.to_numeric(results_df[rank_by], errors='coerce')
+        results_df = results_df.sort_values(rank_by, ascending=False, na_position='last')
+    results_df = results_df.reset_index(drop=True)
+    return results_df, details
+
+
+#Walk-forward: optimize on each train window, trade the winner on the test window that follows
+def walk_forward_windows(n, train_bars, test_bars, anchored=False):
+    """(train_start, test_start, test_end) row positions. Rolling windows
+    slide the train window by test_bars; anchored ones keep it starting at
+    bar 0. A shorter last test window covers the remaining bars."""
+    if train_bars < 2 or test_bars < 2:
+        raise ValueError('train_bars and test_bars must be at least 2')
+    windows = []
+    test_start = train_bars
+    while n - test_start >= 2:
+        test_end = min(n, test_start + test_bars)
+        windows.append((0 if anchored else test_start - train_bars, test_start, test_end))
+        test_start = test_end
+    return windows
+
+
+def equity_curve(Strategy, df, cash, qty, params, engine='backtrader'):
+    value = None
+    if engine=='numpy' and vectorized.supports(Strategy):
+        value = vectorized.equity(Strategy, df, cash, qty, params)
+    if value is None:
+        value = cerebro_equity(Strategy, df, cash, qty, params)[1]
+    return np.asarray(value, dtype=float)
+
+
+def optimize_window(data, task):
+    """Optimize one train window of the OHLCV bundle and run the best
+    parameters on its test window. The run starts at the train window so
+    indicators are warm on the first test bar; its value over the test bars
+    is rebased to `cash` at the last train bar."""
+    Strategy, cash, qty, strategy_params, engine, search, budget, seed, rank_by, (train_start, test_start, test_end) = task
+    train = data.rows(train_start, test_start)
+    test = data.rows(test_start, test_end)
+    records = list(iter_optimizer(Strategy, train, cash, qty, strategy_params, engine, 1, search, budget, seed))
+    best = max(records, key=lambda record: -np.inf if record[rank_by] is None or np.isnan(record[rank_by]) else record[rank_by])
+    value = equity_curve(Strategy, data.rows(train_start, test_end), cash, qty, best['strategy'], engine)
+    warmup = test_start - train_start
+    value = value[warmup:] - value[warmup - 1] + cash
+    return {
+        'train_start': train.index[0], 'test_start': test.index[0], 'test_end': test.index[-1],
+        'evaluated': len(records),
+        'strategy': best['strategy'],
+        'in-sample returns (%)': best['returns (%)'],
+        'in-sample sharpe_ratio': best['sharpe_ratio'],
+        'returns (%)': total_returns(value, cash)['rtot']*100,
+        'sharpe_ratio': sharpe_ratio(bar_returns(value, cash), daily_return)['sharperatio'],
+        'max_drawdown (%)': drawdown_stats(value)['max']['drawdown'],
+    }, test.index, value
+
+def _optimize_window_task(task):
+    return optimize_window(_worker_df, task)
+
+
+def run_walk_forward(Strategy, df, cash, qty, strategy_params, train_bars, test_bars, anchored=False, engine='backtrader',
+                     workers=None, search='grid', budget=None, seed=None, rank_by='returns (%)', on_window=None):
+    """Walk-forward optimization. Windows are optimized in parallel, each
+    worker running its window's search serially over views of one shared
+    memory-mapped OHLCV bundle (combinations of a window share their
+    indicators through the worker's indicator cache). Returns a table with
+    one row per window (best parameters, in-sample and out-of-sample
+    metrics) and the out-of-sample equity of the test windows stitched
+    together, each window's PnL carried onto the previous window's end."""
+    windows = walk_forward_windows(len(df), train_bars, test_bars, anchored)
+    if not windows:
+        raise ValueError(f'{len(df)} bars leave no test window after {train_bars} train bars')
+    workers = max(1, min(len(windows), workers or os.cpu_count() or 1))
+    tasks = [(Strategy, cash, qty, strategy_params, engine, search, budget, seed, rank_by, window) for window in windows]
+    data = df if isinstance(df, OHLCV) else OHLCV.from_frame(df)
+    results = [None] * len(tasks)
+    with stage('walk-forward'):
+        if workers == 1:
+            for i, task in enumerate(tasks):
+                results[i] = optimize_window(data, task)
+                if on_window is not None:
+                    on_window(results[i][0], i + 1, len(tasks))
+        else:
+            shared = data.share()
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_optimizer_worker, initargs=(shared,))
+            try:
+                futures = dict((executor.submit(_optimize_window_task, task), i) for i, task in enumerate(tasks))
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    if on_window is not None:
+                        on_window(results[futures[future]][0], done, len(tasks))
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+                shared.release()
+
+    rows, curves = [], []
+    carried = cash
+    for i, (row, dates, value) in enumerate(results):
+        rows.append(dict(window=i + 1, **row))
+        curves.append(pd.DataFrame({'Date': dates, 'window': i + 1, 'equity': value - cash + carried}))
+        carried += value[-1] - cash
+    return pd.DataFrame(rows), pd.concat(curves, ignore_index=True)
@@ -0,0 +1,262 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import strategy
+from backtest import run_backtest, run_optimizer, run_universe, run_walk_forward
+from datacache import CSVSource, MarketDataCache, PartitionedFileSource
+from resultstore import RESULT_STORE, ResultStore
+
+#Headless batch runner: backtests and optimizations described in a JSON or
+#YAML job file (YAML needs PyYAML), results written as CSV/JSON under the
+#output directory, one folder per job.
+#
+#   python batch.py jobs.yaml --output results
+#
+#   output: results
+#   defaults: {cash: 1000000, qty: 10, engine: numpy, start: 2020-01-01}
+#   data: {source: yfinance}            # or csv / local with a directory
+#   jobs:
+#     - name: banks
+#       strategies: [MACross, RSI]
+#       tickers: [BBRI.JK, BBCA.JK]
+#     - name: bbri-ma
+#       strategy: StrategyMACross
+#       tickers: [BBRI.JK]
+#       end: 2024-12-31
+#       grid: {fast_ma: {start: 5, stop: 20, step: 5}, slow_ma: [30, 50, 100]}
+#       search: random
+#       budget: 8
+#       walk_forward: {train_bars: 500, test_bars: 100}
+#
+#A job without a grid backtests every (strategy, ticker) pair with the given
+#params; a grid runs the optimizer per ticker, backtests the best params and,
+#with walk_forward, validates them out of sample. Grid values are a list or
+#an inclusive {start, stop, step} range. `store: true` (or a path) keeps the
+#optimizer records in a resultstore so reruns skip evaluated combinations.
+
+JOB_DEFAULTS = {
+    'cash': 1000000,
+    'qty': 10,
+    'engine': 'backtrader',
+    'workers': None,
+    'start': None,
+    'end': None,
+    'params': None,
+    'grid': None,
+    'search': 'grid',
+    'budget': None,
+    'seed': None,
+    'time_budget': None,
+    'walk_forward': None,
+    'store': False,
+    'detail': False,
+    'refresh': True,
+}
+
+
+def load_jobs(path):
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    if isinstance(spec, list):
+        spec = {'jobs': spec}
+    if not spec.get('jobs'):
+        raise ValueError(f'No jobs in {path}')
+    return spec
+
+
+def resolve_strategy(name):
+    """Strategy class by class name, with or without the 'Strategy' prefix."""
+    for attr in (name, 'Strategy' + name):
+        cls = getattr(strategy, attr, None)
+        if isinstance(cls, type):
+            return cls
+    raise ValueError(f'Unknown strategy {name}')
+
+
+def grid_values(name, value):
+    if isinstance(value, dict):
+        start, stop, step = value['start'], value['stop'], value.get('step', 1)
+        if all(isinstance(v, int) for v in (start, stop, step)):
+            return range(start, stop + 1, step)
+        #Float ranges are rounded to the step's precision
+        digits = max(0, -int(np.floor(np.log10(abs(step))))) + 2
+        return [round(float(v), digits) for v in np.arange(start, stop + step / 2.0, step)]
+    if isinstance(value, (list, tuple)) and value:
+        return list(value)
+    raise ValueError(f'Invalid grid for {name}. Expected a list of values or {{start, stop, step}}.')
+
+
+def make_market_data(data):
+    data = dict(data or {})
+    source = data.get('source', 'yfinance')
+    if source == 'local':
+        return PartitionedFileSource(data['directory'])
+    cache = {'root': data['cache']} if data.get('cache') else {}
+    if source == 'csv':
+        return MarketDataCache(source=CSVSource(data['directory']), **cache)
+    if source == 'yfinance':
+        return MarketDataCache(**cache)
+    raise ValueError(f'Unknown data source {source}. Expected yfinance, csv or local.')
+
+
+def date_text(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def safe_name(name):
+    return ''.join(c if c.isalnum() or c in '._=-' else '_' for c in str(name))
+
+
+def write_frame(frame, directory, name, written):
+    path = os.path.join(directory, name)
+    frame.to_csv(path, index=False)
+    written.append(path)
+
+
+def write_json(obj, directory, name, written):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2, default=str)
+    written.append(path)
+
+
+def write_result(result, directory, written, prefix=''):
+    """The run_backtest tuple as CSV files."""
+    names = ('metrics', 'trades', 'transactions', 'positions', 'returns', 'equity', 'indicators')
+    for name, frame in zip(names, result):
+        if isinstance(frame, pd.DataFrame):
+            write_frame(frame, directory, prefix + name + '.csv', written)
+
+
+def run_backtests(job, Strategy, market_data, directory, written):
+    results_df, details = run_universe(
+        Strategy, job['tickers'], job['cash'], job['qty'], params=job['params'], start=job['start'], end=job['end'],
+        market_data=market_data, engine=job['engine'], workers=job['workers'], refresh=job['refresh'], detail=job['detail'],
+        on_result=lambda row, done, total: print(f"  {Strategy.__name__} {row['ticker']} ({done}/{total})"
+                                                 + (f" error: {row['error']}" if isinstance(row.get('error'), str) else ''))
+    )
+    results_df.insert(0, 'strategy', Strategy.__name__)
+    for ticker, result in details.items():
+        ticker_dir = os.path.join(directory, safe_name(ticker))
+        os.makedirs(ticker_dir, exist_ok=True)
+        write_result(result, ticker_dir, written, prefix=Strategy.__name__ + '_')
+    return results_df
+
+
+def run_optimizations(job, Strategy, market_data, directory, written):
+    strategy_params = {key: grid_values(key, value) for key, value in job['grid'].items()}
+    store = job['store'] and (RESULT_STORE if job['store'] is True else ResultStore(job['store']))
+    rows = []
+    for ticker in job['tickers']:
+        row = {'strategy': Strategy.__name__, 'ticker': ticker}
+        rows.append(row)
+        ticker_dir = os.path.join(directory, safe_name(ticker), Strategy.__name__)
+        try:
+            df = market_data.history(ticker, job['start'], job['end'], refresh=job['refresh'])
+            if df.empty:
+                row['error'] = 'no data'
+                continue
+            df = df.set_index('Date')
+            os.makedirs(ticker_dir, exist_ok=True)
+            start_time = time.time()
+            results_df, best_params = run_optimizer(
+                Strategy, df, job['cash'], job['qty'], strategy_params, engine=job['engine'], workers=job['workers'] or 1,
+                time_budget=job['time_budget'], search=job['search'], budget=job['budget'], seed=job['seed'], store=store or None)
+            row.update(bars=len(df), combinations=len(results_df), seconds=round(time.time() - start_time, 3),
+                       best_params=json.dumps(best_params, default=str))
+            write_frame(results_df, ticker_dir, 'optimizer.csv', written)
+            write_json(best_params, ticker_dir, 'best_params.json', written)
+
+            result = run_backtest(Strategy, df, job['cash'], job['qty'], False, False, optimized=True,
+                                  best_params_dict=best_params, engine=job['engine'], cache=False,
+                                  profile='full' if job['detail'] else 'summary')
+            if isinstance(result[0], pd.DataFrame):
+                row.update(zip(result[0]['metric'], result[0]['value']))
+            write_result(result if job['detail'] else result[:1], ticker_dir, written)
+
+            if job['walk_forward']:
+                wf = dict(job['walk_forward'])
+                windows_df, equity_df = run_walk_forward(
+                    Strategy, df, job['cash'], job['qty'], strategy_params, wf['train_bars'], wf['test_bars'],
+                    anchored=wf.get('anchored', False), engine=job['engine'], workers=job['workers'],
+                    search=job['search'], budget=job['budget'], seed=job['seed'])
+                row['OOS RETURN [%]'] = (equity_df['equity'].iloc[-1] / job['cash'] - 1) * 100
+                write_frame(windows_df, ticker_dir, 'walk_forward_windows.csv', written)
+                write_frame(equity_df, ticker_dir, 'walk_forward_equity.csv', written)
+        except Exception as e:
+            row['error'] = f'{type(e).__name__}: {e}'
+        print(f"  {Strategy.__name__} {ticker}" + (f" error: {row['error']}" if 'error' in row else f" best {row['best_params']}"))
+    return pd.DataFrame(rows)
+
+
+def run_job(job, market_data, output):
+    """Run one job and write its files; returns a summary record."""
+    name = job.get('name') or '_'.join(job['tickers'][:3])
+    directory = os.path.join(output, safe_name(name))
+    os.makedirs(directory, exist_ok=True)
+    names = job.get('strategies') or [job['strategy']]
+    written = []
+    start_time = time.time()
+    tables = []
+    for strategy_name in names:
+        Strategy = resolve_strategy(strategy_name)
+        if job['grid']:
+            tables.append(run_optimizations(job, Strategy, market_data, directory, written))
+        else:
+            tables.append(run_backtests(job, Strategy, market_data, directory, written))
+    summary = pd.concat(tables, ignore_index=True)
+    write_frame(summary, directory, 'summary.csv', written)
+    errors = int(summary['error'].notna().sum()) if 'error' in summary.columns else 0
+    return {'name': name, 'rows': len(summary), 'errors': errors,
+            'seconds': round(time.time() - start_time, 3), 'files': written}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run backtests and optimizations from a JSON/YAML job file.')
+    parser.add_argument('jobs', help='job file (.json, .yaml or .yml)')
+    parser.add_argument('--output', help='output directory (default: the job file\'s output, else "results")')
+    parser.add_argument('--only', nargs='+', help='run only the jobs with these names')
+    parser.add_argument('--workers', type=int, help='override the worker count of every job')
+    args = parser.parse_args(argv)
+
+    spec = load_jobs(args.jobs)
+    output = args.output or spec.get('output') or 'results'
+    market_data = make_market_data(spec.get('data'))
+    defaults = dict(JOB_DEFAULTS, **(spec.get('defaults') or {}))
+
+    report = []
+    for job in spec['jobs']:
+        job = dict(defaults, **job)
+        if args.only and job.get('name') not in args.only:
+            continue
+        if args.workers is not None:
+            job['workers'] = args.workers
+        job['start'], job['end'] = date_text(job['start']), date_text(job['end'])
+        print(f"Job {job.get('name') or job['tickers']}")
+        try:
+            record = run_job(job, market_data, output)
+        except Exception as e:
+            record = {'name': job.get('name'), 'error': f'{type(e).__name__}: {e}'}
+        print(json.dumps({k: v for k, v in record.items() if k != 'files'}))
+        report.append(record)
+
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, 'report.json'), 'w') as f:
+        json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'jobs': report}, f, indent=2, default=str)
+    print(f"Wrote {sum(len(r.get('files', [])) for r in report)} files to {output}")
+    return 1 if any(r.get('error') or r.get('errors') for r in report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import argparse
+import inspect
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import strategy
+import vectorized
+from backtest import run_backtest, run_optimizer
+from chart import build_lightweight_charts
+
+#Offline benchmark suite: times run_backtest for every strategy, optimizer
+#grids of increasing size and the lightweight-charts payload build on seeded
+#synthetic OHLCV, and writes the results as JSON for comparison between
+#commits.
+#
+#   python benchmark.py --sizes 1000 10000 --output bench.json
+#   python benchmark.py --compare bench.json
+
+STRATEGIES = [cls for name, cls in inspect.getmembers(strategy, inspect.isclass)
+              if cls.__module__ == strategy.__name__ and name.startswith('Strategy')]
+OPTIMIZER_GRIDS = [
+    {'fast_ma': range(5, 11, 5), 'slow_ma': range(30, 41, 10)},
+    {'fast_ma': range(5, 21, 5), 'slow_ma': range(30, 61, 10)},
+    {'fast_ma': range(5, 41, 5), 'slow_ma': range(30, 101, 10)},
+]
+#Business days run out before pandas' Timestamp limit past ~70k bars
+DAILY_LIMIT = 50000
+
+
+def synthetic_ohlcv(n, seed=0, start='2000-01-03'):
+    """Seeded geometric random walk shaped like normalized yfinance history:
+    Open/High/Low/Close/Volume on a Date index, business days up to
+    DAILY_LIMIT bars and minutes beyond."""
+    rng = np.random.default_rng(seed)
+    close = 100.0 * np.exp(np.cumsum(rng.normal(0.0002, 0.02, n)))
+    open_ = close * (1 + rng.normal(0, 0.005, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, n)))
+    volume = rng.integers(100000, 10000000, n).astype(float)
+    index = pd.date_range(start, periods=n, freq='B' if n <= DAILY_LIMIT else 'min', name='Date')
+    return pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}, index=index)
+
+
+def measure(func, memory=True):
+    """(seconds, peak traced MB, result). Peak memory comes from a second,
+    traced call so tracing overhead stays out of the timing. Both calls
+    start with a cold indicator cache."""
+    vectorized.INDICATOR_CACHE.clear()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        vectorized.INDICATOR_CACHE.clear()
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+    return seconds, peak, result
+
+
+def run_case(results, case, func, memory):
+    try:
+        seconds, peak, result = measure(func, memory)
+    except Exception as e:
+        case['error'] = f'{type(e).__name__}: {e}'
+        result = None
+    else:
+        case['seconds'] = round(seconds, 6)
+        case['peak_mb'] = round(peak, 3) if peak is not None else None
+        if case.get('bars'):
+            case['bars_per_sec'] = round(case['bars'] * case.get('combinations', 1) / seconds, 1)
+        if case.get('combinations'):
+            case['combinations_per_sec'] = round(case['combinations'] / seconds, 3)
+    results.append(case)
+    print(json.dumps(case))
+    return result
+
+
+def chart_inputs(df, result):
+    """Frames shaped the way pages/2_Backtest.py passes them to the chart."""
+    _, trades, tx, _, timeret, equity, indicators = (r.copy() if isinstance(r, pd.DataFrame) else r for r in result)
+    return df.reset_index(), tx, equity.rename(columns={'index': 'Date'}), trades, timeret, indicators
+
+
+def bench_backtests(results, sizes, engines, cash, qty, seed, memory):
+    for n in sizes:
+        df = synthetic_ohlcv(n, seed)
+        for Strategy in STRATEGIES:
+            for engine in engines:
+                if engine == 'numpy' and not vectorized.supports(Strategy):
+                    #Would fall back to Cerebro and be recorded under the wrong engine
+                    continue
+                case = {'group': 'run_backtest', 'name': Strategy.__name__, 'engine': engine, 'bars': n}
+                result = run_case(results, case, lambda: run_backtest(Strategy, df, cash, qty, False, False, engine=engine, cache=False), memory)
+                if Strategy is strategy.StrategyMACross and engine == engines[0] and result is not None:
+                    inputs = chart_inputs(df, result)
+                    case = {'group': 'render_lightweight', 'name': 'build_lightweight_charts', 'bars': n}
+                    charts = run_case(results, case, lambda: build_lightweight_charts(*[x.copy() for x in inputs], 'BENCH'), memory)
+                    if charts is not None:
+                        case['payload_bytes'] = len(json.dumps(charts))
+
+
+def bench_optimizer(results, bars, engines, cash, qty, seed, workers, memory):
+    df = synthetic_ohlcv(bars, seed)
+    for grid in OPTIMIZER_GRIDS:
+        combinations = int(np.prod([len(v) for v in grid.values()]))
+        for engine in engines:
+            case = {'group': 'run_optimizer', 'name': strategy.StrategyMACross.__name__, 'engine': engine,
+                    'bars': bars, 'combinations': combinations, 'workers': workers}
+            run_case(results, case, lambda: run_optimizer(strategy.StrategyMACross, df, cash, qty, grid, engine=engine, workers=workers, store=None), memory)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, results):
+    """Print the time ratio old/new for every case present in both runs."""
+    with open(old_path) as f:
+        old = json.load(f)
+    key = lambda c: (c['group'], c['name'], c.get('engine'), c.get('bars'), c.get('combinations'))
+    before = dict((key(c), c) for c in old['results'] if 'seconds' in c)
+    print(f"\nSpeed-up against {old_path} ({old['meta'].get('commit')}):")
+    for case in results:
+        prev = before.get(key(case))
+        if prev is not None and case.get('seconds'):
+            print(f"{'/'.join(str(k) for k in key(case) if k is not None):<60} {prev['seconds']:>10.4f}s -> {case['seconds']:>10.4f}s  x{prev['seconds'] / case['seconds']:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks on synthetic OHLCV.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='bar counts for run_backtest and the chart payload (up to 1000000)')
+    parser.add_argument('--engines', nargs='+', default=['backtrader', 'numpy'])
+    parser.add_argument('--optimizer-bars', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cash', type=float, default=1000000)
+    parser.add_argument('--qty', type=int, default=10)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['run_backtest', 'run_optimizer'])
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced peak-memory pass')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier JSON output to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    memory = not args.no_memory
+    if 'run_backtest' not in args.skip:
+        bench_backtests(results, args.sizes, args.engines, args.cash, args.qty, args.seed, memory)
+    if 'run_optimizer' not in args.skip:
+        bench_optimizer(results, args.optimizer_bars, args.engines, args.cash, args.qty, args.seed, args.workers, memory)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f'Wrote {len(results)} results to {args.output}')
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == '__main__':
+    main()
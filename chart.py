@@ -3,105 +3,155 @@ from __future__ import (absolute_import, division, print_function,
 import pandas as pd
 import numpy as np
 import pandas as pd
-from streamlit_lightweight_charts import renderLightweightCharts
-import json
-import streamlit as st
-
-
-def buysell_markers(df):
-    markers = []
-    for _, row in df.iterrows():
-        if row['signal'] == 'buy':
-            marker = {
-                "time": row['time'],
-                "position": 'belowBar',
-                #"color":'rgba(38,166,154,0.9)', #green
-                "color":'#3f51b5',
-                "shape": 'arrowUp',
-                "text": 'BUY'
-            }
-            markers.append(marker)
-        elif row['signal'] == 'sell':
-            marker = {
-                "time": row['time'],
-                "position": 'aboveBar',
-                #"color":'rgba(239,83,80,0.9)', #red
-                "color":'#e81e63',
-                "shape": 'arrowDown',
-                "text": 'SELL'
-            }
-            markers.append(marker)
-    return markers
-
-def pnl_markers(df):
-    markers = []
-    for _, row in df.iterrows():
-        if row['PnL']>=0:
-            marker = {
-                "time": row['time'],
-                "position": 'aboveBar',
-                "color":'#009688', #blue
-                "shape": 'circle',
-                "text": 'PROFIT'
-            }
-            markers.append(marker)
-        elif row['PnL']<0:
-            marker = {
-                "time": row['time'],
-                "position": 'aboveBar',
-                "color":'#f44336', #red
-                "shape": 'circle',
-                "text": 'LOSS'
-            }
-            markers.append(marker)
-    return markers
+from profiling import stage
+from resultcache import frame_fingerprint
+from downsample import lttb, bucket_starts, aggregate_ohlc
 
-#lightweight
-def render_lightweight(df, transaction_df, equity_df, trades_df, timereturn_df, indicators_df, ticker, render_key='multipane'):
+
+BUY_MARKER = {"position": 'belowBar', "color": '#3f51b5', "shape": 'arrowUp', "text": 'BUY'}
+SELL_MARKER = {"position": 'aboveBar', "color": '#e81e63', "shape": 'arrowDown', "text": 'SELL'}
+PROFIT_MARKER = {"position": 'aboveBar', "color": '#009688', "shape": 'circle', "text": 'PROFIT'}
+LOSS_MARKER = {"position": 'aboveBar', "color": '#f44336', "shape": 'circle', "text": 'LOSS'}
+
+
+def chart_times(values, intraday=False):
+    """Dates -> 'YYYY-MM-DD' strings, or UNIX seconds of the wall time for
+    intraday bars, in one vectorized step (None for NaT)."""
+    dates = pd.Series(pd.to_datetime(values, errors='coerce'))
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    stamps = dates.to_numpy(dtype='datetime64[ns]')
+    if intraday:
+        return np.where(np.isnat(stamps), None, stamps.astype('datetime64[s]').astype(np.int64)).astype(object)
+    days = stamps.astype('datetime64[D]')
+    return np.where(np.isnat(days), None, np.datetime_as_string(days)).astype(object)
+
+def is_intraday(values):
+    """True when any bar has a time of day."""
+    stamps = pd.to_datetime(pd.Series(values), errors='coerce').dropna()
+    return bool(len(stamps)) and bool((stamps != stamps.dt.normalize()).any())
+
+def series_data(times, **columns):
+    """lightweight-charts data points straight from equal-length arrays.
+    Rows with a NaN value become whitespace points ({'time': t}); rows
+    without a time are dropped."""
+    keys = ('time',) + tuple(columns)
+    values = [np.asarray(v) for v in columns.values()]
+    missing = np.zeros(len(times), dtype=bool)
+    for v in values:
+        if v.dtype.kind == 'f':
+            missing |= np.isnan(v)
+    rows = zip(times.tolist(), *(v.tolist() for v in values))
+    return [{'time': row[0]} if miss else dict(zip(keys, row)) for row, miss in zip(rows, missing.tolist()) if row[0] is not None]
+
+def markers(times, choices):
+    """One marker per row whose first matching mask in `choices` ((mask,
+    template) pairs) picks the template, in row order."""
+    pick = np.select([mask for mask, _ in choices], np.arange(len(choices)), -1)
+    templates = [template for _, template in choices]
+    return [dict(templates[c], time=t) for t, c in zip(times.tolist(), pick.tolist()) if c >= 0 and t is not None]
+
+def buysell_markers(times, signal):
+    signal = np.asarray(signal)
+    return markers(times, [(signal == 'buy', BUY_MARKER), (signal == 'sell', SELL_MARKER)])
+
+def pnl_markers(times, pnl):
+    pnl = np.asarray(pnl, dtype=float)
+    return markers(times, [(pnl >= 0, PROFIT_MARKER), (pnl < 0, LOSS_MARKER)])
+
+def downsample_candles(times, ohlcv, max_points, keep_times):
+    """OHLC buckets of the candle arrays, at most about max_points candles
+    plus the marker bars."""
+    if not max_points or len(times) <= max_points:
+        return times, ohlcv
+    starts = bucket_starts(len(times), max_points, np.flatnonzero(np.isin(times, keep_times)))
+    return times[starts], aggregate_ohlc(*ohlcv, starts)
+
+def downsample_line(times, values, max_points, keep_times):
+    """(times, values) kept by LTTB, plus the marker rows."""
+    if not max_points or len(times) <= max_points:
+        return times, values
+    rows = lttb(values, max_points, np.flatnonzero(np.isin(times, keep_times)))
+    return times[rows], values[rows]
+
+def on_timeline(n, rows, values):
+    """values placed at `rows` of an n-point timeline, NaN elsewhere."""
+    aligned = np.full(n, np.nan)
+    aligned[rows] = values
+    return aligned
+
+def line_data(times, values, max_points=None, keep_times=()):
+    times, values = downsample_line(times, np.asarray(values, dtype=float), max_points, keep_times)
+    return series_data(times, value=values)
+
+def inputs_fingerprint(*inputs):
+    """Content key of the chart inputs, None when one cannot be hashed."""
     try:
-        df.columns = ['Date','open','high','low','close','volume', 'dividends', 'stock splits'] 
-    except:
-        df.columns = ['Date','open','high','low','close','volume'] 
+        return tuple(frame_fingerprint(x) if isinstance(x, pd.DataFrame) else repr(x) for x in inputs)
+    except TypeError:
+        return None
+
+#lightweight
+def render_lightweight(df, transaction_df, equity_df, trades_df, timereturn_df, indicators_df, ticker, render_key='multipane', max_points=None):
+    """`max_points` caps the points sent per pane (None sends every bar).
+    The last payload is memoized per render_key in the session, so a rerun
+    with unchanged inputs skips the payload build. This is not a delta
+    update: renderLightweightCharts only takes a full payload, so changed
+    inputs rebuild and send every pane."""
+    import streamlit as st
+    from streamlit_lightweight_charts import renderLightweightCharts
+    last_payloads = st.session_state.setdefault('lightweight_payloads', {})
+    with stage('chart'):
+        last = last_payloads.get(render_key)
+        key = inputs_fingerprint(df, transaction_df, equity_df, trades_df, indicators_df, ticker, max_points)
+        if last is not None and key is not None and last['inputs'] == key:
+            charts = last['charts']
+        else:
+            with stage('payload'):
+                charts = build_lightweight_charts(df, transaction_df, equity_df, trades_df, timereturn_df, indicators_df, ticker, max_points)
+            last_payloads[render_key] = {'inputs': key, 'charts': charts}
+        with stage('render'):
+            try:
+                renderLightweightCharts(charts, render_key)
+            except:
+                #Retry without the indicators pane
+                renderLightweightCharts(charts[:2], render_key)
+
+
+def build_lightweight_charts(df, transaction_df, equity_df, trades_df, timereturn_df, indicators_df, ticker, max_points=None):
+    """Panes (chart options plus series) passed to renderLightweightCharts.
+    Series are built from the NumPy columns without touching the input
+    frames. With max_points every pane is downsampled to about that many
+    points, split between its line series; marker bars are always kept."""
     COLOR_BULL = 'rgba(38,166,154,0.9)' 
     COLOR_BEAR = 'rgba(239,83,80,0.9)'  
-    df['time'] = df['Date'].dt.strftime('%Y-%m-%d') 
-    df['color'] = np.where(df['open'] > df['close'], COLOR_BEAR, COLOR_BULL)
-    candles = json.loads(df.to_json(orient = "records"))
-    #st.write(df)
+    #Date, open, high, low, close, volume by position (dividends and splits may follow)
+    intraday = is_intraday(df.iloc[:, 0])
+    times = chart_times(df.iloc[:, 0], intraday)
+    ohlcv = tuple(df.iloc[:, i].to_numpy(dtype=float) for i in range(1, 6))
 
-    #transaction_df = transaction_df.rename(columns={'date':'time'})
     try:
-        transaction_df['time'] = transaction_df['date'].dt.strftime('%Y-%m-%d') 
+        tx_times = chart_times(transaction_df['date'], intraday)
+        tx_signal = transaction_df['signal'].to_numpy()
     except:
-        pass
-    #st.write(transaction_df)
-
-    #equity_df = equity_df.rename(columns={'Date':'time'})
-    equity_df['time'] = pd.to_datetime(equity_df['Date'], errors='coerce')
-    equity_df['time'] = equity_df['time'].dt.strftime('%Y-%m-%d') 
-    equity_df['equity'] = equity_df['equity'].bfill()
-    equity_df['cash'] = equity_df['cash'].bfill()
-    equity_df['negative_return'] = equity_df['current_return'].apply(lambda x: x if (x is not None and x < 0) else np.nan)
-    portfolio = json.loads(equity_df[['time','equity']].rename(columns={'equity':'value'}).to_json(orient='records'))
-    cash_balance = json.loads(equity_df[['time','cash']].rename(columns={'cash':'value'}).to_json(orient='records'))
-    drawdown_json = json.loads(equity_df[['time','drawdown']].rename(columns={'drawdown':'value'}).to_json(orient='records'))
-    negative_returns_json = json.loads(equity_df[['time','negative_return']].rename(columns={'negative_return':'value'}).to_json(orient='records'))
-    returns_json = json.loads(equity_df[['time','current_return']].rename(columns={'current_return':'value'}).to_json(orient='records'))
-    #st.write(equity_df)
-
-    trades_df['time'] = pd.to_datetime(trades_df['ExitTime'], errors='coerce')
-    trades_df['time'] = trades_df['time'].dt.strftime('%Y-%m-%d') 
-
-    timereturn_df['time'] = pd.to_datetime(timereturn_df['Date'], errors='coerce')
-    timereturn_df['time'] = timereturn_df['time'].dt.strftime('%Y-%m-%d') 
-    #returns_json = json.loads(timereturn_df[['time','Value']].rename(columns={'Value':'value'}).to_json(orient='records'))
-
+        tx_times = tx_signal = np.array([], dtype=object)
     try:
-        indicators_df['time'] = pd.to_datetime(indicators_df['datetime'], errors='coerce')
-        indicators_df['time'] = indicators_df['time'].dt.strftime('%Y-%m-%d') 
-        indicators_df = indicators_df.merge(equity_df[['time']], how='outer', on='time').drop(columns='datetime').sort_values('time',ascending=True).dropna(axis=1, how='all')
+        exit_times = chart_times(trades_df['ExitTime'], intraday)
+        pnl = trades_df['PnL'].to_numpy(dtype=float)
     except:
-        pass
+        exit_times = pnl = np.array([], dtype=object)
+    keep_times = np.concatenate([tx_times, exit_times]) if max_points else []
+
+    times, (open_, high, low, close, volume) = downsample_candles(times, ohlcv, max_points, keep_times)
+    candles = series_data(times, open=open_, high=high, low=low, close=close,
+                          color=np.where(open_ > close, COLOR_BEAR, COLOR_BULL))
+
+    equity_times = chart_times(equity_df['Date'], intraday)
+    line_points = max_points // 2 if max_points else None
+    portfolio = line_data(equity_times, equity_df['equity'].bfill(), line_points, keep_times)
+    cash_balance = line_data(equity_times, equity_df['cash'].bfill(), line_points, keep_times)
+    #drawdown_json = line_data(equity_times, equity_df['drawdown'])
+    #returns_json = line_data(equity_times, equity_df['current_return'])
 
     chartMultipaneOptions = [
             {"height": 200,
@@ -156,7 +206,7 @@ def render_lightweight(df, transaction_df, equity_df, trades_df, timereturn_df,
         {"type": 'Line',"data": portfolio, 
         "options":{"color":'#3f51b5',#'rgba(38,166,154,0.9)',
                     "priceFormat": {"type": 'volume',}},
-        "markers": pnl_markers(trades_df[['time','PnL']])
+        "markers": pnl_markers(exit_times, pnl)
         },
         {"type": 'Line',"data": cash_balance,  
         "options":{"color":'#e81e63',#'rgba(255, 192, 0, 1)',#'rgba(239,83,80,0.9)',
@@ -168,57 +218,54 @@ def render_lightweight(df, transaction_df, equity_df, trades_df, timereturn_df,
             "data": candles,
             "options": {"upColor": COLOR_BULL,"downColor": COLOR_BEAR,"borderVisible": False,
                         "wickUpColor": COLOR_BULL,"wickDownColor": COLOR_BEAR},
-            "markers": buysell_markers(transaction_df)
+            "markers": buysell_markers(tx_times, tx_signal)
             },
         ]
-    seriesReturnsChart = [
-        {"type": 'Line',"data": returns_json, 
-        "options":{"color":'rgba(38,166,154,0.9)',
-                    "priceFormat": {"type": 'volume',}},
-        },
-        ]
-    seriesDrawdownChart = [
-        {"type": 'Line',"data": drawdown_json,  
-        "options":{"color":'rgba(239,83,80,0.9)',
-                    "priceFormat": {"type": 'volume',}}
-        },
-        #{"type": 'Line',"data": negative_returns_json,  
-        #"options":{"color":'rgba(38,166,154,0.9)',
-        #            "priceFormat": {"type": 'volume',}}
-        #}
-        ]
+    #seriesReturnsChart = [
+    #    {"type": 'Line',"data": returns_json, 
+    #    "options":{"color":'rgba(38,166,154,0.9)',
+    #                "priceFormat": {"type": 'volume',}},
+    #    },
+    #    ]
+    #seriesDrawdownChart = [
+    #    {"type": 'Line',"data": drawdown_json,  
+    #    "options":{"color":'rgba(239,83,80,0.9)',
+    #                "priceFormat": {"type": 'volume',}}
+    #    },
+    #    ]
     try:
+        #Indicators on the equity timeline (whitespace before warm-up) so the panes line up
+        indicator_times = chart_times(indicators_df['datetime'], intraday)
+        timeline = np.union1d(equity_times[equity_times != None].tolist(), indicator_times[indicator_times != None].tolist())
+        rows = np.searchsorted(timeline, indicator_times[indicator_times != None].tolist())
+        columns = [col for col in indicators_df.columns if col != 'datetime' and indicators_df[col].notna().any()]
         seriesIndicatorsChart = []
         color_options = ["#8fc0cf", "#e7998f", "#f9d269", ]
-        for i in range(0, indicators_df.set_index('time').shape[1]):
-            #st.write(indicators_df.set_index('time').columns[i])
+        line_points = max_points // max(1, len(columns)) if max_points else None
+        for i, column in enumerate(columns):
             seriesIndicatorsChart.append({
             "type": "Line",
-            "data": json.loads(indicators_df[['time', indicators_df.set_index('time').columns[i]]].rename(columns={indicators_df.set_index('time').columns[i]:'value'}).to_json(orient='records')),
+            "data": line_data(timeline, on_timeline(len(timeline), rows, indicators_df[column].to_numpy(dtype=float)[indicator_times != None]), line_points, keep_times),
             "options": {"color": color_options[i % len(color_options)] ,
                         "lineWidth": 2},
-            #"name": indicators_df.set_index('time').columns[i]
+            #"name": column
             })
         #seriesIndicatorsChart = [
         #    {"type": 'Line',"data": ind_1, "name":'rsi_val',
         #    "options":{"priceFormat": {"type": 'volume',}},
         #    },
         #    ]
-        renderLightweightCharts([
+        return [
                 {"chart": chartMultipaneOptions[0],"series": seriesPortfolioChart},
                 {"chart": chartMultipaneOptions[1],"series": seriesCandlestickChart},
                 #{"chart": chartMultipaneOptions[2],"series": seriesReturnsChart},
                 #{"chart": chartMultipaneOptions[3],"series": seriesDrawdownChart},
                 {"chart": chartMultipaneOptions[2],"series": seriesIndicatorsChart},
-                ],
-                    render_key
-            )
+                ]
     except:
-        renderLightweightCharts([
+        return [
             {"chart": chartMultipaneOptions[0],"series": seriesPortfolioChart},
             {"chart": chartMultipaneOptions[1],"series": seriesCandlestickChart},
             #{"chart": chartMultipaneOptions[2],"series": seriesReturnsChart},
             #{"chart": chartMultipaneOptions[3],"series": seriesDrawdownChart},
-            ],
-                render_key
-        )
\ No newline at end of file
+            ]
@@ -0,0 +1,385 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+#Per-ticker Parquet store for daily OHLCV history. Each ticker is a directory
+#of part files sorted by Date; a refresh only fetches bars from the cached
+#tail onwards and rewrites (or adds) the last part, unless the overlap shows
+#the source re-adjusted its history (split or dividend), in which case the
+#whole history is fetched again. Range reads push the date filter down to
+#Parquet row-group statistics.
+
+DEFAULT_ROOT = os.environ.get('BACKTEST_DATA_CACHE', os.path.join('.cache', 'market_data'))
+PART_ROWS = 5000
+ROW_GROUP_SIZE = 1000
+
+
+def normalize_history(df):
+    """yfinance-style history -> flat columns with a tz-naive Date column."""
+    df = df.reset_index() if 'Date' not in df.columns else df.copy()
+    df.columns = df.columns.get_level_values(0)
+    df['Date'] = pd.to_datetime(df['Date'])
+    if df['Date'].dt.tz is not None:
+        df['Date'] = df['Date'].dt.tz_localize(None)
+    return df.sort_values('Date').drop_duplicates(subset='Date', keep='last').reset_index(drop=True)
+
+
+class YFinanceSource(object):
+    """Network source; yfinance is only imported when a fetch is needed."""
+
+    def fetch(self, ticker, start=None):
+        import yfinance as yf
+        ticker_data = yf.Ticker(ticker)
+        if start is None:
+            df = ticker_data.history(period='max')
+        else:
+            df = ticker_data.history(start=pd.Timestamp(start).strftime('%Y-%m-%d'))
+        return normalize_history(df) if not df.empty else pd.DataFrame()
+
+
+class CSVSource(object):
+    """File-based stand-in for the network: reads <directory>/<ticker>.csv
+    with a Date column."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def fetch(self, ticker, start=None):
+        path = os.path.join(self.directory, f'{ticker}.csv')
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        df = normalize_history(pd.read_csv(path, parse_dates=['Date']))
+        if start is not None:
+            df = df[df['Date'] >= pd.Timestamp(start)].reset_index(drop=True)
+        return df
+
+
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+DATE_NAMES = ('date', 'datetime', 'timestamp', 'time')
+CHUNK_ROWS = 1000000
+#Partition files named after the period they hold: 2023, 2023-05, 2023-05-17
+PERIOD_NAME = re.compile(r'^(\d{4})(?:[-_]?(\d{2}))?(?:[-_]?(\d{2}))?$')
+
+
+def column_names(columns):
+    """Actual column name per canonical name (Date, Open, ..., Volume),
+    matched case-insensitively."""
+    names = {}
+    for col in columns:
+        key = str(col).strip().lower()
+        if key in DATE_NAMES and 'Date' not in names:
+            names['Date'] = col
+        elif key.capitalize() in FIELDS:
+            names[key.capitalize()] = col
+    if 'Date' not in names:
+        raise KeyError(f'No date column among {list(columns)}')
+    return names
+
+
+def file_period(path):
+    """[start, end) covered by a partition file named after its period, or
+    None when the name is not a period."""
+    stem = os.path.basename(path).split('.')[0]
+    match = PERIOD_NAME.match(stem)
+    if match is None:
+        return None
+    year, month, day = match.groups()
+    start = pd.Timestamp(int(year), int(month or 1), int(day or 1))
+    if day:
+        return start, start + pd.Timedelta(days=1)
+    return start, start + (pd.DateOffset(months=1) if month else pd.DateOffset(years=1))
+
+
+def downcast_bars(df):
+    """float32 prices and the smallest dtype that holds the volume."""
+    for col in ('Open', 'High', 'Low', 'Close'):
+        if col in df.columns and df[col].dtype != np.float32:
+            df[col] = df[col].astype(np.float32)
+    if 'Volume' in df.columns:
+        volume = df['Volume']
+        if volume.dtype.kind in 'iu':
+            df['Volume'] = pd.to_numeric(volume, downcast='unsigned' if len(volume) and volume.min() >= 0 else 'integer')
+        elif volume.dtype != np.float32:
+            df['Volume'] = volume.astype(np.float32)
+    return df
+
+
+class PartitionedFileSource(object):
+    """Bulk local bars (e.g. years of 1-minute data), read without loading
+    whole files: <directory>/<ticker>.parquet|.csv, or a <ticker>/ directory
+    of such files, optionally one per period (2023.parquet, 2023-05.csv,
+    2023-05-17.csv). Partitions outside the requested range are skipped by
+    name, Parquet reads push the date filter down to row-group statistics
+    and project the OHLCV columns, CSV is read in chunks of chunk_rows
+    (stopping once a sorted file passes the range end), and prices come
+    back as float32. history() matches MarketDataCache.history, and the
+    source can also feed a MarketDataCache through fetch()."""
+
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS, downcast=True):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.downcast = downcast
+
+    def files(self, ticker, start=None, end=None):
+        paths = [os.path.join(self.directory, f'{ticker}.{ext}') for ext in ('parquet', 'csv')]
+        paths = [p for p in paths if os.path.exists(p)]
+        folder = os.path.join(self.directory, ticker)
+        if os.path.isdir(folder):
+            paths += sorted(glob.glob(os.path.join(folder, '**', '*.parquet'), recursive=True)
+                            + glob.glob(os.path.join(folder, '**', '*.csv'), recursive=True))
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        selected = []
+        for path in paths:
+            period = file_period(path)
+            if period is not None and ((start is not None and period[1] <= start) or (end is not None and period[0] > end)):
+                continue
+            selected.append(path)
+        return selected
+
+    def read_parquet(self, paths, start, end):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(paths, format='parquet')
+        names = column_names(dataset.schema.names)
+        date = ds.field(names['Date'])
+        kind = dataset.schema.field(names['Date']).type
+        condition = None
+        if pa.types.is_timestamp(kind):
+            #Bounds in the column's own timezone, matching the tz-naive wall times returned
+            bound = lambda t: pa.scalar(pd.Timestamp(t).tz_localize(kind.tz) if kind.tz else pd.Timestamp(t), type=kind)
+            if start is not None:
+                condition = date >= bound(start)
+            if end is not None:
+                condition = (date <= bound(end)) if condition is None else condition & (date <= bound(end))
+        columns = dict((name, ds.field(col)) for name, col in names.items())
+        if self.downcast:
+            for name in ('Open', 'High', 'Low', 'Close'):
+                if name in columns:
+                    columns[name] = columns[name].cast(pa.float32())
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+    def read_csv(self, path, start, end):
+        names = column_names(pd.read_csv(path, nrows=0).columns)
+        dtype = dict((names[k], np.float32 if self.downcast else np.float64) for k in ('Open', 'High', 'Low', 'Close') if k in names)
+        chunks = []
+        previous = None
+        for chunk in pd.read_csv(path, usecols=list(names.values()), dtype=dtype, chunksize=self.chunk_rows):
+            chunk = chunk.rename(columns=dict((v, k) for k, v in names.items()))
+            chunk['Date'] = pd.to_datetime(chunk['Date'])
+            if chunk['Date'].dt.tz is not None:
+                chunk['Date'] = chunk['Date'].dt.tz_localize(None)
+            ordered = chunk['Date'].is_monotonic_increasing and (previous is None or chunk['Date'].iloc[0] >= previous)
+            previous = chunk['Date'].iloc[-1] if len(chunk) else previous
+            mask = np.ones(len(chunk), dtype=bool)
+            if start is not None:
+                mask &= (chunk['Date'] >= pd.Timestamp(start)).to_numpy()
+            if end is not None:
+                mask &= (chunk['Date'] <= pd.Timestamp(end)).to_numpy()
+            chunks.append(chunk[mask] if not mask.all() else chunk)
+            if end is not None and ordered and previous is not None and previous > pd.Timestamp(end):
+                break
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def history(self, ticker, start=None, end=None, refresh=False):
+        """Bars for [start, end] with a tz-naive Date column, sorted and
+        without duplicate timestamps. `refresh` is accepted for parity with
+        MarketDataCache and ignored. An `end` without a time of day takes
+        in that whole day."""
+        if end is not None:
+            end = pd.Timestamp(end)
+            if end == end.normalize():
+                end = end + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns')
+        paths = self.files(ticker, start, end)
+        frames = []
+        parquet = [p for p in paths if p.endswith('.parquet')]
+        if parquet:
+            frames.append(self.read_parquet(parquet, start, end))
+        for path in paths:
+            if path.endswith('.csv'):
+                frames.append(self.read_csv(path, start, end))
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if df['Date'].dt.tz is not None:
+            df['Date'] = df['Date'].dt.tz_localize(None)
+        if not df['Date'].is_monotonic_increasing:
+            df = df.sort_values('Date', kind='stable')
+        if df['Date'].duplicated().any():
+            df = df.drop_duplicates(subset='Date', keep='last')
+        df = df[['Date'] + [col for col in FIELDS if col in df.columns]].reset_index(drop=True)
+        return downcast_bars(df) if self.downcast else df
+
+    def fetch(self, ticker, start=None):
+        return self.history(ticker, start)
+
+
+class MarketDataCache(object):
+
+    def __init__(self, root=DEFAULT_ROOT, source=None, max_age=3600):
+        self.root = root
+        self.source = source if source is not None else YFinanceSource()
+        #Seconds after a refresh during which the source is not asked again
+        self.max_age = max_age
+
+    def directory(self, ticker):
+        return os.path.join(self.root, re.sub(r'[^A-Za-z0-9._=^-]', '_', ticker))
+
+    def parts(self, ticker):
+        return sorted(glob.glob(os.path.join(self.directory(ticker), 'part-*.parquet')))
+
+    def tail_date(self, ticker):
+        """Last cached bar, read from Parquet footer statistics only."""
+        import pyarrow.parquet as pq
+        parts = self.parts(ticker)
+        if not parts:
+            return None
+        metadata = pq.ParquetFile(parts[-1]).metadata
+        column = metadata.schema.to_arrow_schema().get_field_index('Date')
+        last = None
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(column).statistics
+            if stats is not None and stats.has_min_max:
+                last = stats.max if last is None else max(last, stats.max)
+        return pd.Timestamp(last) if last is not None else pd.read_parquet(parts[-1], columns=['Date'])['Date'].max()
+
+    def is_fresh(self, ticker):
+        stamp = os.path.join(self.directory(ticker), 'refreshed')
+        return bool(self.parts(ticker)) and os.path.exists(stamp) and time.time() - os.path.getmtime(stamp) < self.max_age
+
+    def write_part(self, path, df):
+        #Unique temporary name so concurrent refreshes of a ticker do not clash
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+        os.close(fd)
+        try:
+            df.to_parquet(tmp, index=False, row_group_size=ROW_GROUP_SIZE)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def write_parts(self, ticker, df, first=0):
+        """Write df as part files numbered from `first` on and remove any
+        later parts left from a longer history."""
+        os.makedirs(self.directory(ticker), exist_ok=True)
+        paths = []
+        for i in range(0, len(df), PART_ROWS):
+            paths.append(os.path.join(self.directory(ticker), f'part-{first + i // PART_ROWS:05d}.parquet'))
+            self.write_part(paths[-1], df.iloc[i:i + PART_ROWS])
+        for path in self.parts(ticker):
+            if path not in paths and int(os.path.basename(path)[5:10]) >= first:
+                os.remove(path)
+
+    def adjusted(self, cached, new):
+        """True when the source has re-adjusted history since it was cached:
+        the re-fetched bar before the tail no longer matches, or a dividend
+        or split follows the tail (yfinance prices are auto-adjusted, so
+        either rewrites every earlier bar)."""
+        anchor = cached['Date'].iloc[0]
+        fetched = new[new['Date'] == anchor]
+        columns = [col for col in ('Open', 'High', 'Low', 'Close') if col in cached.columns and col in new.columns]
+        if fetched.empty or not np.allclose(fetched[columns].to_numpy(dtype=float)[:1], cached[columns].to_numpy(dtype=float)[:1], rtol=1e-6, equal_nan=True):
+            return True
+        later = new['Date'] > cached['Date'].iloc[-1]
+        return any(bool((new.loc[later, col].fillna(0) != 0).any()) for col in ('Dividends', 'Stock Splits') if col in new.columns)
+
+    def unchanged(self, cached, new):
+        """True when the fetched bars are exactly the cached tail bars."""
+        columns = [col for col in FIELDS if col in cached.columns and col in new.columns]
+        return (len(new) == len(cached) and (new['Date'].to_numpy() == cached['Date'].to_numpy()).all()
+                and np.allclose(new[columns].to_numpy(dtype=float), cached[columns].to_numpy(dtype=float), rtol=1e-9, equal_nan=True))
+
+    def refresh(self, ticker):
+        """Fetch bars from the bar before the cached tail onwards and merge
+        them in (the tail bar itself is replaced since it may have been
+        partial). When the overlap shows the history was re-adjusted, the
+        full history is fetched again and replaces the cache."""
+        parts = self.parts(ticker)
+        if not parts:
+            new = self.source.fetch(ticker)
+            if new.empty:
+                return 0
+            self.write_parts(ticker, new)
+            self.touch(ticker)
+            return len(new)
+
+        last = pd.read_parquet(parts[-1])
+        #Last two cached bars, the first of which may sit in the previous part
+        recent = last.iloc[-2:] if len(last) >= 2 or len(parts) < 2 else pd.concat([pd.read_parquet(parts[-2]).iloc[-1:], last], ignore_index=True)
+        new = self.source.fetch(ticker, start=recent['Date'].iloc[0])
+        if new.empty:
+            self.touch(ticker)
+            return 0
+        if self.adjusted(recent.reset_index(drop=True), new):
+            new = self.source.fetch(ticker)
+            if new.empty:
+                return 0
+            self.write_parts(ticker, new)
+            self.touch(ticker)
+            return len(new)
+
+        new = new[new['Date'] > recent['Date'].iloc[0]]
+        if self.unchanged(recent.iloc[1:], new):
+            self.touch(ticker)
+            return 0
+        merged = normalize_history(pd.concat([last[last['Date'] < new['Date'].min()], new], ignore_index=True)) if len(new) else last
+        self.write_parts(ticker, merged, int(os.path.basename(parts[-1])[5:10]))
+        self.touch(ticker)
+        return len(merged) - len(last)
+
+    def touch(self, ticker):
+        """Mark the ticker as refreshed now, without touching its parts (so
+        the array snapshot is only rebuilt when the bars change)."""
+        stamp = os.path.join(self.directory(ticker), 'refreshed')
+        with open(stamp, 'a'):
+            os.utime(stamp)
+
+    def history(self, ticker, start=None, end=None, refresh=True):
+        """Cached daily history for [start, end], refreshed from the source
+        first unless it was refreshed within max_age seconds."""
+        if refresh and not self.is_fresh(ticker):
+            self.refresh(ticker)
+        parts = self.parts(ticker)
+        if not parts:
+            return pd.DataFrame()
+        filters = []
+        if start is not None:
+            filters.append(('Date', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('Date', '<=', pd.Timestamp(end)))
+        df = pd.read_parquet(parts, filters=filters or None)
+        return df.sort_values('Date').reset_index(drop=True)
+
+    def arrays(self, ticker, start=None, end=None, refresh=True):
+        """Same range as history() as a memory-mapped arrayfeed.OHLCV. The
+        array snapshot under <ticker>/arrays is rebuilt from the Parquet
+        parts whenever they are newer."""
+        from arrayfeed import OHLCV
+        if refresh and not self.is_fresh(ticker):
+            self.refresh(ticker)
+        parts = self.parts(ticker)
+        if not parts:
+            return None
+        directory = os.path.join(self.directory(ticker), 'arrays')
+        stamp = os.path.join(directory, 'Date.npy')
+        if not os.path.exists(stamp) or os.path.getmtime(stamp) < max(os.path.getmtime(p) for p in parts):
+            tmp = tempfile.mkdtemp(dir=self.directory(ticker), prefix='arrays.', suffix='.tmp')
+            try:
+                OHLCV.from_frame(self.history(ticker, refresh=False).set_index('Date')).save(tmp)
+                shutil.rmtree(directory, ignore_errors=True)
+                os.replace(tmp, directory)
+            except OSError:
+                #Another session put its snapshot in place first
+                if not os.path.exists(stamp):
+                    raise
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+        return OHLCV.load(directory).between(start, end)
@@ -0,0 +1,80 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import numpy as np
+import pandas as pd
+
+#Visual downsampling for the chart payload. Line series keep the points
+#picked by Largest-Triangle-Three-Buckets (Steinarsson, 2013); candles are
+#merged into buckets that keep the first open, the highest high, the lowest
+#low and the last close. Positions passed as `keep` (bars carrying markers)
+#always survive: LTTB adds them to its selection and candle buckets are split
+#so every kept bar stays a candle of its own.
+
+
+def lttb(values, points, keep=None):
+    """Sorted row positions of at most `points` points (plus `keep`) that
+    preserve the visual shape of `values` plotted against its position."""
+    y = np.asarray(values, dtype=np.float64)
+    n = len(y)
+    if not points or n <= points:
+        return np.arange(n)
+    if keep is not None and len(keep):
+        keep = np.asarray(keep, dtype=np.int64)
+        keep = keep[(keep >= 0) & (keep < n)]
+        #Kept points come out of the budget
+        points = max(3, points - len(keep))
+    if n <= points:
+        return np.arange(n)
+    #NaN (indicator warm-up) takes its neighbours' value for the areas only
+    y = pd.Series(y).ffill().bfill().fillna(0.0).to_numpy()
+    #points - 2 buckets between the first and the last point
+    edges = np.floor(np.linspace(1, n - 1, points - 1)).astype(np.int64)
+    edges[-1] = n - 1
+    csum = np.concatenate([[0.0], np.cumsum(y)])
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+        else:
+            nlo, nhi = n - 1, n
+        avg_x = (nlo + nhi - 1) / 2.0
+        avg_y = (csum[nhi] - csum[nlo]) / (nhi - nlo)
+        x = np.arange(lo, hi)
+        area = np.abs((a - avg_x) * (y[lo:hi] - y[a]) - (a - x) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    if keep is not None and len(keep):
+        selected = np.union1d(selected, keep)
+    return selected
+
+
+def bucket_starts(n, points, keep=None):
+    """First row position of every candle bucket: about `points` equal
+    buckets, with each kept position split into a bucket of its own."""
+    if not points or n <= points:
+        return np.arange(n)
+    if keep is None or not len(keep):
+        return np.unique(np.linspace(0, n, points, endpoint=False).astype(np.int64))
+    keep = np.asarray(keep, dtype=np.int64)
+    keep = keep[(keep >= 0) & (keep < n)]
+    #Splitting around a kept bar adds up to two buckets
+    starts = np.unique(np.linspace(0, n, max(1, points - 2 * len(keep)), endpoint=False).astype(np.int64))
+    if len(keep):
+        starts = np.union1d(starts, np.concatenate([keep, keep + 1]))
+        starts = starts[starts < n]
+    return starts
+
+
+def aggregate_ohlc(open_, high, low, close, volume, starts):
+    """(open, high, low, close, volume) per bucket; NaN is ignored in the
+    high/low extremes."""
+    n = len(close)
+    ends = np.append(starts[1:], n) - 1
+    return (np.asarray(open_)[starts],
+            np.fmax.reduceat(np.asarray(high, dtype=np.float64), starts),
+            np.fmin.reduceat(np.asarray(low, dtype=np.float64), starts),
+            np.asarray(close)[ends],
+            np.add.reduceat(np.nan_to_num(np.asarray(volume, dtype=np.float64)), starts))
@@ -0,0 +1,82 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import numpy as np
+import pandas as pd
+
+#Precision of cumulative fill quantities in match_trades_fifo
+LOT_DECIMALS = 9
+
+def build_equity_ledger(equity_df, cash):
+    """Add cash, holdings, equity, drawdown and open-trade return columns to
+    the position/transaction frame using array operations only."""
+    amount = equity_df['amount'].to_numpy(dtype=float)
+    price = equity_df['price'].to_numpy(dtype=float)
+    value = equity_df['Value'].to_numpy(dtype=float)
+    filled = equity_df['signal'].notna().to_numpy() & ~np.isnan(amount) & ~np.isnan(price)
+
+    #Signed transaction flows: buys drain cash, sells return it
+    flow = np.where(filled, amount * price, 0.0)
+    equity_df['cash'] = cash - np.cumsum(flow)
+    equity_df['holdings'] = np.cumsum(np.where(filled, amount, 0.0))
+
+    #Cost basis of the last entry, forward-filled until the next exit (0 = flat)
+    buys = filled & (amount > 0)
+    sells = filled & (amount < 0)
+    basis = pd.Series(np.where(buys, amount * price, np.where(sells, 0.0, np.nan))).ffill().fillna(0.0).to_numpy()
+    prior_basis = np.concatenate(([0.0], basis[:-1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        current_return = np.where((basis > 0) & ~np.isnan(value), (value - basis) / basis * 100, np.nan)
+        closed = sells & (prior_basis > 0)
+        current_return = np.where(closed, (price * -amount - prior_basis) / prior_basis * 100, current_return)
+    equity_df['current_return'] = current_return
+
+    equity_df['equity'] = equity_df['cash'] + equity_df['Value']
+    equity_df['peak_equity'] = equity_df['equity'].cummax()
+    equity_df['drawdown'] = ((equity_df['equity'] - equity_df['peak_equity']) / equity_df['peak_equity'])*(100)
+    return equity_df
+
+
+def fifo_lots(amount):
+    """Matched lots of the signed fill amounts, first-in-first-out: (size,
+    entry fill, exit fill) arrays, one row per lot closed by an exit, plus
+    the number of entries not fully closed at the end."""
+    amount = np.asarray(amount)
+    entries = amount > 0
+    exits = amount < 0
+    #Rounded so float sizes that add up to the same quantity meet on one bound
+    #instead of leaving near-zero lots between them
+    entry_cum = np.round(np.cumsum(amount[entries]), LOT_DECIMALS)
+    exit_cum = np.round(np.cumsum(-amount[exits]), LOT_DECIMALS)
+    matched = min(entry_cum[-1] if len(entry_cum) else 0, exit_cum[-1] if len(exit_cum) else 0)
+
+    #Every entry/exit boundary on the cumulative quantity axis closes a lot
+    bounds = np.union1d(entry_cum, exit_cum)
+    bounds = bounds[bounds <= matched]
+    starts = np.concatenate(([0], bounds))[:len(bounds)].astype(bounds.dtype)
+    entry_idx = np.flatnonzero(entries)[np.searchsorted(entry_cum, starts, side='right')]
+    exit_idx = np.flatnonzero(exits)[np.searchsorted(exit_cum, starts, side='right')]
+    return bounds - starts, entry_idx, exit_idx, int((entry_cum > matched).sum())
+
+
+def match_trades_fifo(amount, price, date):
+    """Pair entry and exit fills first-in-first-out from the transaction
+    arrays. Partial exits and scale-ins are split into one row per matched
+    lot; entries still open at the end are left out. PnL is per unit."""
+    price = np.asarray(price, dtype=float)
+    date = np.asarray(date, dtype='datetime64[ns]')
+    size, entry_idx, exit_idx, _ = fifo_lots(amount)
+
+    entry_price = price[entry_idx]
+    exit_price = price[exit_idx]
+    entry_time = date[entry_idx]
+    exit_time = date[exit_idx]
+    return pd.DataFrame({
+        'Size': size,
+        'EntryPrice': entry_price,
+        'ExitPrice': exit_price,
+        'PnL': exit_price - entry_price,
+        'ReturnPct': ((exit_price - entry_price) / entry_price) * 100,
+        'EntryTime': entry_time,
+        'ExitTime': exit_time,
+        'Duration': exit_time - entry_time
+    })
@@ -0,0 +1,273 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import math
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import backtrader as bt
+from ledger import LOT_DECIMALS, fifo_lots
+
+#Performance metrics computed from the per-bar portfolio value and the fills.
+#The formulas follow backtrader's SharpeRatio, DrawDown, Returns,
+#TradeAnalyzer, SQN, TimeReturn and Calmar analyzers so the table matches
+#the one built from the analyzers, without their per-bar bookkeeping.
+
+#Conversion factors used by backtrader's SharpeRatio and Returns analyzers on daily data
+RATE_FACTOR = 252
+TANN = 252.0
+CALMAR_PERIOD = 36
+
+#Rows of the performance table rounded to 5 decimals
+ROUNDED = (
+    'EXPOSURE TIME [%]', 'RETURN [%]', 'BUY & HOLD RETURN [%]', 'RETURN (ANN.) [%]', 'RETURN VOLATILITY [%]',
+    'SHARPE RATIO', 'CALMAR RATIO', 'MAX. DRAWDOWN [%]',
+    'AVG. DRAWDOWN [%]', 'WIN RATE [%]', 'BEST TRADE RETURN [%]',
+    'WORST TRADE RETURN [%]', 'AVG. TRADE RETURN [%]', 'PROFIT FACTOR',
+    'EXPECTANCY RETURN', 'SQN',
+)
+
+#Metrics that need at least one closed trade
+TRADE_METRICS = (
+    'EXPOSURE TIME [%]', 'TOTAL TRADES', 'WIN RATE [%]', 'BEST TRADE RETURN [%]', 'WORST TRADE RETURN [%]',
+    'AVG. TRADE RETURN [%]', 'MAX. TRADE DURATION', 'AVG. TRADE DURATION', 'PROFIT FACTOR',
+    'EXPECTANCY RETURN', 'SQN',
+)
+
+
+def drawdown_stats(value):
+    peak = np.maximum.accumulate(value)
+    dd = 100.0 * (peak - value) / peak
+    idx = np.arange(len(value))
+    streak = idx - np.maximum.accumulate(np.where(dd == 0, idx, -1))
+    return {
+        'len': int(streak[-1]),
+        'drawdown': float(dd[-1]),
+        'moneydown': float(peak[-1] - value[-1]),
+        'max': {'len': int(streak.max()), 'drawdown': float(dd.max()), 'moneydown': float((peak - value).max())},
+    }
+
+
+def sharpe_ratio(returns, riskfreerate):
+    rate = pow(1.0 + riskfreerate, 1.0 / RATE_FACTOR) - 1.0
+    ret_free = returns - rate
+    retdev = ret_free.std() if len(ret_free) else 0.0
+    return {'sharperatio': float(ret_free.mean() / retdev) if retdev else None}
+
+
+def total_returns(value, cash):
+    return final_returns(value[-1], len(value), cash)
+
+
+def final_returns(final, periods, cash):
+    """Returns analyzer output from the final value over `periods` periods."""
+    rtot = math.log(final / cash) if final > 0 else float('-inf')
+    ravg = rtot / periods
+    rnorm = math.expm1(ravg * TANN) if ravg > float('-inf') else ravg
+    return {'rtot': rtot, 'ravg': ravg, 'rnorm': rnorm, 'rnorm100': rnorm * 100.0}
+
+
+def trade_stats(fill_idx, amount, price):
+    """TradeAnalyzer-style totals of the FIFO-matched lots (a partial exit or
+    a scale-in closes several lots), their cash PnL and their returns in %."""
+    size, entry, exit_, open_ = fifo_lots(amount)
+    closed = len(size)
+    trades = {'total': {'total': closed + open_}}
+    if closed == 0:
+        return trades, np.array([]), np.array([])
+    pnl = (price[exit_] - price[entry]) * size
+    returns = (price[exit_] - price[entry]) / price[entry] * 100
+    barlen = fill_idx[exit_] - fill_idx[entry]
+    won = pnl >= 0.0
+    trades['total'].update({'open': trades['total']['total'] - closed, 'closed': closed})
+    for name, mask in (('won', won), ('lost', ~won)):
+        total = float(pnl[mask].sum())
+        trades[name] = {'total': int(mask.sum()), 'pnl': {'total': total, 'average': total / (mask.sum() or 1.0)}}
+    trades['len'] = {'total': int(barlen.sum()), 'average': barlen.sum() / closed, 'max': int(barlen.max())}
+    return trades, pnl, returns
+
+
+def bars_in_market(fill_idx, amount):
+    """Bars between consecutive fills during which a position was held
+    (overlapping lots counted once). Bars after the last fill are left out,
+    like an open trade in the closed-trade lengths."""
+    held = np.round(np.cumsum(amount), LOT_DECIMALS) > 0
+    return int(np.diff(fill_idx)[held[:-1]].sum()) if len(fill_idx) > 1 else 0
+
+
+def sqn(pnl):
+    if len(pnl) > 1:
+        pnl_stddev = pnl.std()
+        return {'sqn': math.sqrt(len(pnl)) * pnl.mean() / pnl_stddev if pnl_stddev else None, 'trades': len(pnl)}
+    return {'sqn': 0, 'trades': len(pnl)}
+
+
+def calmar(dates, value, cash):
+    """Last value of backtrader's Calmar analyzer (monthly, 36 periods)."""
+    months = dates.year * 100 + dates.month
+    month_start = np.flatnonzero(np.diff(months, prepend=-1))
+    sampled = value[month_start]
+    peak = np.maximum.accumulate(sampled)
+    maxdd = float((100.0 * (peak - sampled) / peak).max())
+    values = ([float('nan')] * CALMAR_PERIOD + [cash] + sampled.tolist() + [value[-1]])[-CALMAR_PERIOD:]
+    rann = math.log(values[-1] / values[0]) / CALMAR_PERIOD
+    return {dates[-1]: rann / (maxdd or float('inf'))}
+
+
+def day_values(dates, value):
+    """Value at the last bar of every day, the periods backtrader's SharpeRatio
+    and Returns see with timeframe=Days. Daily bars pass through."""
+    dates = pd.DatetimeIndex(dates)
+    days = dates.normalize()
+    if (days == dates).all():
+        return value
+    days = days.values.view(np.int64)
+    return value[np.flatnonzero(np.append(np.diff(days) != 0, True))]
+
+
+def exposure_time(bars, dates):
+    """Bars in the market in % of the calendar days spanned for daily bars
+    (the original definition) or of the bar count for intraday bars."""
+    dates = pd.DatetimeIndex(dates)
+    if (dates.normalize() == dates).all():
+        return bars / (dates.max() - dates.min()).days * 100
+    return bars / len(dates) * 100
+
+
+def bar_returns(value, cash):
+    return value / np.concatenate(([cash], value[:-1])) - 1.0
+
+
+def performance(dates, value, cash, fill_idx, amount, price, close, riskfreerate, names=None):
+    """Performance table rows (metric -> value, in table order) from arrays:
+    bar dates, portfolio value per bar, fills as (bar index, signed amount,
+    price) and the close series for buy & hold. `names` restricts the rows.
+    Raises KeyError when trade metrics are requested and no trade closed."""
+    dates = pd.DatetimeIndex(dates)
+    value = np.asarray(value, dtype=float)
+    fill_idx = np.asarray(fill_idx, dtype=np.int64)
+    amount = np.asarray(amount, dtype=float)
+    price = np.asarray(price, dtype=float)
+    wanted = lambda name: names is None or name in names
+
+    timereturn = bar_returns(value, cash)
+    daily = day_values(dates, value)
+    returns = total_returns(daily, cash)
+    drawdown = drawdown_stats(value)
+    duration = dates.max() - dates.min()
+    positive = timereturn[timereturn > 0]
+
+    data = OrderedDict()
+    data['START'] = dates.min()
+    data['END'] = dates.max()
+    data['DURATION'] = duration
+    if any(wanted(name) for name in TRADE_METRICS):
+        trades, pnl, trade_returns = trade_stats(fill_idx, amount, price)
+        win_rate = trades['won']['total'] / trades['total']['closed']
+        lost = trades['lost']['pnl']['total']
+        data['EXPOSURE TIME [%]'] = exposure_time(bars_in_market(fill_idx, amount), dates)
+    data['EQUITY FINAL [IDR]'] = float(value[-1])
+    data['EQUITY PEAK [IDR]'] = float(value.max())
+    data['RETURN [%]'] = returns['rtot'] * 100
+    data['BUY & HOLD RETURN [%]'] = ((close[-1] - close[0]) / close[0]) * 100
+    data['RETURN (ANN.) [%]'] = returns['rnorm100']
+    data['RETURN VOLATILITY [%]'] = np.std(positive, ddof=1) * 100 if len(positive) > 1 else float('nan')
+    data['SHARPE RATIO'] = sharpe_ratio(bar_returns(daily, cash), riskfreerate)['sharperatio']
+    data['CALMAR RATIO (BACKTRADER)'] = list(calmar(dates, value, cash).values())[-1]
+    data['CALMAR RATIO'] = returns['rnorm100'] / drawdown['max']['drawdown'] if drawdown['max']['drawdown'] != 0 else float('inf')
+    data['MAX. DRAWDOWN [%]'] = drawdown['max']['drawdown']
+    data['AVG. DRAWDOWN [%]'] = drawdown['drawdown']
+    data['MAX. DRAWDOWN DURATION'] = drawdown['max']['len']
+    data['AVG. DRAWDOWN DURATION'] = drawdown['len']
+    if 'EXPOSURE TIME [%]' in data:
+        data['TOTAL TRADES'] = trades['total']['total']
+        data['WIN RATE [%]'] = win_rate * 100
+        data['BEST TRADE RETURN [%]'] = trade_returns.max()
+        data['WORST TRADE RETURN [%]'] = trade_returns.min()
+        data['AVG. TRADE RETURN [%]'] = trade_returns.mean()
+        data['MAX. TRADE DURATION'] = trades['len']['max']
+        data['AVG. TRADE DURATION'] = trades['len']['average']
+        data['PROFIT FACTOR'] = trades['won']['pnl']['total'] / abs(lost) if lost != 0 else float('inf')
+        data['EXPECTANCY RETURN'] = (win_rate * trades['won']['pnl']['average']) - ((1 - win_rate) * abs(trades['lost']['pnl']['average']))
+        data['SQN'] = sqn(pnl)['sqn']
+    if names is not None:
+        data = OrderedDict((name, value) for name, value in data.items() if name in names)
+    return data
+
+
+def headline(dates, final, cash, close, names=None):
+    """The rows that need only the final portfolio value: span, final
+    equity, total and annualized return and buy & hold."""
+    dates = pd.DatetimeIndex(dates)
+    returns = final_returns(final, len(day_values(dates, dates)), cash)
+    data = OrderedDict()
+    data['START'] = dates.min()
+    data['END'] = dates.max()
+    data['DURATION'] = dates.max() - dates.min()
+    data['EQUITY FINAL [IDR]'] = float(final)
+    data['RETURN [%]'] = returns['rtot'] * 100
+    data['BUY & HOLD RETURN [%]'] = ((close[-1] - close[0]) / close[0]) * 100
+    data['RETURN (ANN.) [%]'] = returns['rnorm100']
+    if names is not None:
+        data = OrderedDict((name, value) for name, value in data.items() if name in names)
+    return data
+
+
+def metrics_table(data):
+    """metric/value DataFrame with the ROUNDED rows rounded to 5 decimals
+    (None, e.g. an undefined Sharpe ratio, is kept as is)."""
+    return pd.DataFrame({
+        'metric': list(data.keys()),
+        'value': [round(float(value), 5) if metric in ROUNDED and value is not None else value for metric, value in data.items()],
+    })
+
+
+class EquityRecorder(bt.Analyzer):
+    """Broker value per bar and executed fills, in arrays preallocated from
+    the data length. Everything metrics.performance needs from a Cerebro run."""
+
+    def start(self):
+        n = max(self.strategy.data.buflen(), 1)
+        self.rows = np.empty(n, dtype=np.int64)
+        self.values = np.empty(n)
+        self.bars = 0
+        self.fills = []
+
+    def notify_order(self, order):
+        if order.status in (order.Partial, order.Completed):
+            for exbit in order.executed.iterpending():
+                if exbit is None:
+                    break
+                self.fills.append((self.bars, exbit.size, exbit.price))
+
+    def next(self):
+        i = self.bars
+        if i == len(self.values):
+            self.rows = np.resize(self.rows, 2 * i)
+            self.values = np.resize(self.values, 2 * i)
+        self.rows[i] = len(self.strategy.data) - 1
+        self.values[i] = self.strategy.broker.getvalue()
+        self.bars = i + 1
+
+    def get_analysis(self):
+        fills = np.array(self.fills, dtype=float).reshape(-1, 3)
+        return {
+            'dates': self.strategy.data.p.dataname.index[self.rows[:self.bars]],
+            'value': self.values[:self.bars],
+            'fill_idx': fills[:, 0].astype(np.int64),
+            'amount': fills[:, 1],
+            'price': fills[:, 2],
+        }
+
+
+class FinalValueRecorder(bt.Analyzer):
+    """Broker value at the end of the run only; no per-bar work. Enough for
+    metrics.headline."""
+
+    def start(self):
+        self.final = None
+
+    def stop(self):
+        self.final = self.strategy.broker.getvalue()
+
+    def get_analysis(self):
+        return {'dates': self.strategy.data.p.dataname.index, 'final': self.final}
@@ -0,0 +1,131 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import os
+import numpy as np
+import pandas as pd
+from metrics import RATE_FACTOR
+
+#Monte Carlo robustness check on a finished backtest: the closed-trade PnL
+#(trades_df) or the per-bar returns (timereturn_df) are resampled into many
+#equity paths at once. Paths are generated as (paths, steps) matrices in
+#chunks sized to max_bytes, and only the per-path metrics are kept.
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get('BACKTEST_MONTECARLO_MB', 64)) * 1024 * 1024)
+PERCENTILES = (5, 25, 50, 75, 95)
+METHODS = ('bootstrap', 'shuffle')
+#(paths, steps) matrices alive at once while a chunk is evaluated
+CHUNK_MATRICES = 4
+
+
+def resample_indices(rng, n, paths, method='bootstrap', block=1):
+    """(paths, n) positions into the observed steps: draws with replacement
+    (in blocks of `block` consecutive steps when block > 1) or one
+    permutation per path."""
+    if method == 'shuffle':
+        return rng.permuted(np.tile(np.arange(n, dtype=np.int32), (paths, 1)), axis=1)
+    if method != 'bootstrap':
+        raise ValueError(f'Unknown method {method}. Expected one of {list(METHODS)}.')
+    if block <= 1:
+        return rng.integers(0, n, size=(paths, n), dtype=np.int32)
+    block = min(block, n)
+    starts = rng.integers(0, n - block + 1, size=(paths, -(-n // block)), dtype=np.int32)
+    return (starts[:, :, None] + np.arange(block, dtype=np.int32)).reshape(paths, -1)[:, :n]
+
+
+def sharpe_rows(excess):
+    """metrics.sharpe_ratio per row (population deviation, NaN when flat)."""
+    n = excess.shape[1]
+    mean = excess.sum(axis=1) / n
+    deviation = np.sqrt(np.maximum(np.einsum('ij,ij->i', excess, excess) / n - mean * mean, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(deviation > 0, mean / deviation, np.nan)
+
+
+def compounded_metrics(log_growth, excess, cash):
+    """Final equity, max drawdown [%] and Sharpe ratio per row, from the
+    log growth and excess return of every step. Drawdowns are taken in log
+    space so the equity matrix itself is never built."""
+    level = np.cumsum(log_growth, axis=1)
+    final = cash * np.exp(level[:, -1])
+    peak = np.maximum.accumulate(level, axis=1)
+    #Starting cash is the first peak
+    np.maximum(peak, 0.0, out=peak)
+    peak -= level
+    max_drawdown = -100.0 * np.expm1(-peak.max(axis=1))
+    return final, max_drawdown, sharpe_rows(excess)
+
+
+def additive_metrics(pnl, cash):
+    """Same metrics for rows of PnL amounts added to the starting cash. The
+    Sharpe ratio is per trade with a zero risk-free rate, since a per-bar
+    rate does not apply to trades of varying length."""
+    equity = cash + np.cumsum(pnl, axis=1)
+    before = np.empty_like(equity)
+    before[:, 0] = cash
+    before[:, 1:] = equity[:, :-1]
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), cash)
+    max_drawdown = (100.0 * (peak - equity) / peak).max(axis=1)
+    return equity[:, -1], max_drawdown, sharpe_rows(pnl / before)
+
+
+def simulate(steps, cash, paths=10000, method='bootstrap', compounding=True, block=1, seed=None,
+             riskfreerate=0.0, max_bytes=DEFAULT_MAX_BYTES):
+    """Per-path metrics (final equity, return [%], max drawdown [%], sharpe
+    ratio) of `paths` resampled equity paths as a DataFrame. `steps` are
+    per-step returns when compounding, PnL amounts otherwise; drawdown and
+    Sharpe follow metrics.drawdown_stats and metrics.sharpe_ratio. The
+    risk-free rate is a per-bar rate, so it only applies when compounding."""
+    steps = np.asarray(steps, dtype=np.float64)
+    steps = steps[~np.isnan(steps)]
+    n = len(steps)
+    if n == 0:
+        raise ValueError('No returns to resample')
+    if compounding:
+        rate = pow(1.0 + riskfreerate, 1.0 / RATE_FACTOR) - 1.0
+        log_growth = np.log1p(steps)
+        excess = steps - rate
+    rng = np.random.default_rng(seed)
+    chunk = max(1, int(max_bytes // (n * 8 * CHUNK_MATRICES)))
+    final = np.empty(paths)
+    max_drawdown = np.empty(paths)
+    sharpe = np.empty(paths)
+    for lo in range(0, paths, chunk):
+        hi = min(paths, lo + chunk)
+        idx = resample_indices(rng, n, hi - lo, method, block)
+        if compounding:
+            metrics = compounded_metrics(log_growth[idx], excess[idx], cash)
+        else:
+            metrics = additive_metrics(steps[idx], cash)
+        final[lo:hi], max_drawdown[lo:hi], sharpe[lo:hi] = metrics
+    return pd.DataFrame({'final equity': final, 'return [%]': (final / cash - 1.0) * 100.0,
+                         'max drawdown [%]': max_drawdown, 'sharpe ratio': sharpe})
+
+
+def percentile_bands(samples, percentiles=PERCENTILES):
+    """Metric rows with a column per percentile plus the mean."""
+    bands = pd.DataFrame(np.nanpercentile(samples.to_numpy(), percentiles, axis=0).T,
+                         index=samples.columns, columns=[f'p{p}' for p in percentiles])
+    bands['mean'] = samples.mean().to_numpy()
+    return bands
+
+
+def trade_pnl(trades_df):
+    """Cash PnL of every closed lot (trades_df PnL is per unit)."""
+    return trades_df['PnL'].to_numpy(dtype=float) * trades_df['Size'].to_numpy(dtype=float)
+
+
+def trade_monte_carlo(trades_df, cash, paths=10000, method='bootstrap', seed=None, percentiles=PERCENTILES, max_bytes=DEFAULT_MAX_BYTES):
+    """Resample the closed trades' cash PnL (fixed stake, so PnL adds up)
+    and return (percentile bands, per-path samples)."""
+    samples = simulate(trade_pnl(trades_df), cash, paths, method, compounding=False,
+                       seed=seed, max_bytes=max_bytes)
+    return percentile_bands(samples, percentiles), samples
+
+
+def return_monte_carlo(timereturn_df, cash, paths=10000, method='bootstrap', block=1, seed=None, riskfreerate=0.0,
+                       percentiles=PERCENTILES, max_bytes=DEFAULT_MAX_BYTES):
+    """Resample the per-bar returns (`block` > 1 keeps runs of consecutive
+    bars together) and return (percentile bands, per-path samples)."""
+    samples = simulate(timereturn_df['Value'].to_numpy(dtype=float), cash, paths, method, compounding=True, block=block,
+                       seed=seed, riskfreerate=riskfreerate, max_bytes=max_bytes)
+    return percentile_bands(samples, percentiles), samples
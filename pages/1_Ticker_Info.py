@@ -7,6 +7,7 @@ from datetime import datetime
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
+from datacache import MarketDataCache
 
 
 st.set_page_config(page_title="Backtester", layout="wide")
@@ -34,9 +35,7 @@ try:
         pass
 
     start_time = time.time()
-    df_raw = ticker_data.history(period='max').reset_index()
-    df_raw.columns = df_raw.columns.get_level_values(0)
-    df_raw['Date'] = df_raw['Date'].dt.tz_localize(None)
+    df_raw = MarketDataCache().history(ticker)
     end_time = time.time() 
     processing = end_time - start_time  
     st.markdown("""
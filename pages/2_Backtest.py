@@ -1,7 +1,7 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 import streamlit as st
-import yfinance as yf
+import os
 import time
 from datetime import datetime
 import pandas as pd
@@ -9,7 +9,12 @@ import streamlit as st
 from millify import prettify
 import strategy
 from chart import render_lightweight
-from backtest import run_backtest, run_optimizer
+from datacache import MarketDataCache, PartitionedFileSource
+from backtest import run_backtest, run_optimizer, run_walk_forward, count_combinations, daily_return
+from profiling import Profile, profiled, stage
+from montecarlo import trade_monte_carlo, return_monte_carlo
+from search import make_search
+from resultstore import RESULT_STORE
 
 st.set_page_config(page_title="Backtester", layout="wide")
 st.title("Backtest")
@@ -17,6 +22,14 @@ st.title("Backtest")
 col1, col2, col3, col4, col5 = st.columns([1.5,2.5,1.5,2,2.5])
 with col1.container(border=True):
     ticker = st.text_input("Stock Ticker", 'BBRI.JK')
+    data_source = st.selectbox("Data source", ["Yahoo Finance", "Local files"])
+    if data_source == "Local files":
+        local_directory = st.text_input("Bars directory", os.environ.get("BACKTEST_LOCAL_DATA", "data"),
+                                        help="<ticker>.parquet/.csv or a <ticker>/ folder of per-period files (e.g. 2023-05.parquet)")
+        market_data = PartitionedFileSource(local_directory)
+    else:
+        market_data = MarketDataCache()
+    trace_memory = st.checkbox("Trace memory per stage", help="tracemalloc peaks in the stage timings; slows the run down")
 with col3.container(border=True):
     qty = st.number_input("Trades Quantity", step=1, value=10, min_value=1)
 with col4.container(border=True):
@@ -26,7 +39,7 @@ with col2.container(border=True):
                                                         min_value=datetime(2020, 1, 1), max_value=datetime.today().date(), format="YYYY.MM.DD")
 with col5.container(border=True):
     strategy_name = st.selectbox("Strategy", ["MA Crossover", "RSI", "Parabolic SAR",
-                                              "MACD","Bollinger","WilliamsR","Harami"
+                                              "MACD","Bollinger","WilliamsR","Pivot Breakout","Harami"
                                               ])
     strategy_map = {
         "RSI": strategy.StrategyRSI,
@@ -35,6 +48,7 @@ with col5.container(border=True):
         "MACD":strategy.StrategyMACD,
         "Bollinger":strategy.StrategyBollinger,
         "WilliamsR":strategy.StrategyWilliamsR,
+        "Pivot Breakout":strategy.StrategyPivot,
         "Harami":strategy.StrategyHarami
     }
     Strategy = strategy_map[strategy_name]
@@ -68,6 +82,10 @@ def metric_value(df, name, round_val=2, prettify_val=False):
     except Exception as e:
         return str(val) if "val" in locals() else None
 
+def show_stage_timings(profile):
+    with st.expander("See Stage Timings"):
+        st.dataframe(profile.to_frame().style.format({"seconds": "{:.4f}", "peak_mb": "{:.2f}", "share [%]": "{:.1f}"}))
+
 def get_metric(df, name):
     return df.loc[df["metric"] == name, "value"].iloc[0]
 
@@ -115,24 +133,27 @@ def metric_with_delta(opt_df, base_df, name, round_val=2, prettify_val=False):
     return val_opt, delta
 
 try:
+    start_date = str(date_filter[0])
+    end_date = str(date_filter[1])
+    profile = Profile(memory=trace_memory)
     start_time = time.time()
-    ticker_data = yf.Ticker(ticker)
-    df_raw = ticker_data.history(period='max').reset_index()
-    df_raw.columns = df_raw.columns.get_level_values(0)
-    df_raw['Date'] = df_raw['Date'].dt.tz_localize(None)
+    with profiled(profile=profile), stage("data fetch"):
+        df_raw = market_data.history(ticker, start_date, end_date)
     end_time = time.time() 
     processing = end_time - start_time  
 
     if strategy_name in ["RSI","MA Crossover","Parabolic SAR","MACD"]:
         optimized = st.checkbox("Optimize the backtesting strategy", label_visibility="visible")
+        engine = "numpy" if st.checkbox("Fast engine (NumPy, bypasses Backtrader)", label_visibility="visible") else "backtrader"
     else:
         optimized = False
-    start_date = str(date_filter[0])
-    end_date = str(date_filter[1])
-    df_raw = df_raw[(df_raw['Date']>=start_date) & (df_raw['Date']<=end_date)]
+        engine = "backtrader"
 
-    resampling = False
+    resampling = st.multiselect("Higher-timeframe levels", ["W", "M", "Q", "Y"],
+                                help="Pivot support/resistance of the last completed weekly/monthly/quarterly/yearly bar, added to the indicators")
     cheating = False
+    max_points = st.number_input("Chart points per pane (0 = every bar)", step=500, value=5000, min_value=0,
+                                 help="Long histories are downsampled (LTTB for lines, OHLC buckets for candles); bars with trade markers are always kept")
 
     with st.container(border=True):
         st.write("### Backtesting Strategy")
@@ -143,7 +164,8 @@ try:
             df = df_raw.set_index("Date")
 
             start_time = time.time()
-            perf, trades, tx, pos, timeret, equity, indicators = run_backtest(Strategy, df, cash, qty, cheating, resampling)
+            with profiled(profile=profile):
+                perf, trades, tx, pos, timeret, equity, indicators = run_backtest(Strategy, df, cash, qty, cheating, resampling, engine=engine)
             st.info(f"Processed time backtesting: {time.time() - start_time:.4f} seconds")
 
             # -------------------------
@@ -189,13 +211,29 @@ try:
                 st.write("#### Equity", equity)
                 st.write("#### Indicator", indicators)
 
+            with st.expander("See Monte Carlo Robustness"):
+                col_src, col_m, col_p = st.columns(3)
+                mc_source = col_src.selectbox("Resample", ["Daily returns", "Closed trades"])
+                mc_method = col_m.selectbox("Method", ["bootstrap", "shuffle"])
+                mc_paths = col_p.number_input("Paths", step=1000, value=10000, min_value=100, max_value=200000)
+                try:
+                    if mc_source == "Closed trades":
+                        bands, _ = trade_monte_carlo(trades, cash, paths=mc_paths, method=mc_method, seed=0)
+                    else:
+                        bands, _ = return_monte_carlo(timeret, cash, paths=mc_paths, method=mc_method, seed=0, riskfreerate=daily_return)
+                    st.write("#### Percentile bands", bands)
+                except Exception as e:
+                    st.write(f"Monte Carlo unavailable: {e}")
+
             # -------------------------
             #  FINAL CHART RENDER
             # -------------------------
             df = df.reset_index()
             equity = equity.rename(columns={"index": "Date"})
 
-            render_lightweight(df, tx, equity, trades, timeret, indicators, ticker)
+            with profiled(profile=profile):
+                render_lightweight(df, tx, equity, trades, timeret, indicators, ticker, max_points=max_points or None)
+            show_stage_timings(profile)
 
 
     # ------------------------------
@@ -232,14 +270,62 @@ try:
             strategy_params = {k: range_optimization_ranges[k] for k in params.__dict__.keys() if k in range_optimization_ranges}
 
             st.code(strategy_params)
+            search_modes = {
+                "Grid (exhaustive)": "grid",
+                "Random sampling": "random",
+                "Successive halving": "halving",
+                "Bayesian (TPE)": "tpe",
+            }
+            grid_size = count_combinations(strategy_params)
+            col_s, col_n, col_w, col_b = st.columns(4)
+            search_mode = search_modes[col_s.selectbox("Search mode", list(search_modes))]
+            budget = None
+            if search_mode != "grid":
+                budget = col_n.number_input(f"Evaluation budget (grid has {grid_size})", step=1,
+                                            value=max(1, grid_size // 4), min_value=1, max_value=grid_size)
+            #One worker by default: sessions share the server's cores
+            workers = col_w.number_input("Optimizer workers", step=1, value=1, min_value=1, max_value=os.cpu_count() or 1,
+                                         help="Processes for this optimization; the server's cores are shared by every session")
+            time_budget = col_b.number_input("Time budget in seconds (0 = no limit)", step=10, value=0, min_value=0)
+            reuse_results = st.checkbox("Reuse stored optimizer results", help=f"Keep every evaluated combination in {RESULT_STORE.path} and skip the ones evaluated before")
+            walk_forward = st.checkbox("Walk-forward validation", help="Optimize on rolling train windows and trade the winners on the bars that follow")
+            if walk_forward:
+                col_tr, col_te, col_a = st.columns(3)
+                train_bars = col_tr.number_input("Train bars", step=10, value=max(20, len(df_raw) // 2), min_value=20)
+                test_bars = col_te.number_input("Test bars", step=5, value=max(5, len(df_raw) // 10), min_value=5)
+                anchored = col_a.checkbox("Anchored train windows", help="Every train window starts at the first bar")
 
             # -------------------------------------------
             # RUN OPTIMIZER
             # -------------------------------------------
-            with st.spinner("Optimizing backtesting strategy..."):
+            progress_bar = st.progress(0.0, text="Optimizing backtesting strategy...")
+            leaderboard = st.empty()
+            opt_start = time.time()
+            opt_records = []
+
+            def show_progress(record, done, total):
+                opt_records.append(record)
+                rate = done / max(time.time() - opt_start, 1e-9)
+                progress_bar.progress(done / total, text=f"{done}/{total} combinations ({rate:.1f} combinations/sec)")
+                if done == total or done % max(1, total // 50) == 0:
+                    leaderboard.dataframe(pd.DataFrame(opt_records).sort_values('returns (%)', ascending=False).head(10))
+
+            opt_profile = Profile(memory=trace_memory)
+            with st.spinner("Optimizing backtesting strategy..."), profiled(profile=opt_profile):
                 results_df, best_params_dict = run_optimizer(
-                    Strategy, df_raw.set_index("Date"), cash, qty, strategy_params
+                    Strategy, df_raw.set_index("Date"), cash, qty, strategy_params, engine=engine, workers=workers,
+                    time_budget=time_budget or None, on_result=show_progress, search=search_mode, budget=budget,
+                    store=RESULT_STORE if reuse_results else None
                 )
+                leaderboard.empty()
+                opt_total = make_search(search_mode, strategy_params, budget=budget).total
+                if len(results_df) < opt_total:
+                    st.warning(f"Time budget reached: stopped after {len(results_df)} of {opt_total} combinations")
+                st.info(f"Optimization took {time.time() - opt_start} seconds")
+                stored_count = int(results_df["stored"].sum()) if "stored" in results_df.columns else 0
+                if stored_count:
+                    st.caption(f"{stored_count} combinations served from the optimizer result store")
+                st.success(f'\n Best parameter: {best_params_dict}')
                 with st.expander("See Details"):
                     st.write(results_df)
 
@@ -247,16 +333,18 @@ try:
             # RUN OPTIMIZED BACKTEST
             # -------------------------------------------
             start_time = time.time()
-            perf_opt, trades_opt, tx_opt, pos_opt, tre_opt, eq_opt, ind_opt = run_backtest(
-                Strategy,
-                df_raw.set_index("Date"),
-                cash,
-                qty,
-                cheating,
-                resampling,
-                best_params_dict=best_params_dict,
-                optimized=True,
-            )
+            with profiled(profile=opt_profile):
+                perf_opt, trades_opt, tx_opt, pos_opt, tre_opt, eq_opt, ind_opt = run_backtest(
+                    Strategy,
+                    df_raw.set_index("Date"),
+                    cash,
+                    qty,
+                    cheating,
+                    resampling,
+                    best_params_dict=best_params_dict,
+                    optimized=True,
+                    engine=engine,
+                )
             st.info(f"Processed time backtesting: {time.time() - start_time:.4f} seconds")
 
             # -------------------------------------------
@@ -299,15 +387,35 @@ try:
             # -------------------------------------------
             # RENDER OPTIMIZED CHART
             # -------------------------------------------
-            render_lightweight(
-                df_raw,
-                tx_opt,
-                eq_opt.rename(columns={"index": "Date"}),
-                trades_opt,
-                tre_opt,
-                ind_opt,
-                ticker,
-                render_key="optimized_multipane",
-            )
+            with profiled(profile=opt_profile):
+                render_lightweight(
+                    df_raw,
+                    tx_opt,
+                    eq_opt.rename(columns={"index": "Date"}),
+                    trades_opt,
+                    tre_opt,
+                    ind_opt,
+                    ticker,
+                    render_key="optimized_multipane",
+                    max_points=max_points or None,
+                )
+
+            # -------------------------------------------
+            # WALK-FORWARD (OUT-OF-SAMPLE)
+            # -------------------------------------------
+            if walk_forward:
+                st.write("#### Walk-forward (out-of-sample)")
+                with st.spinner("Running walk-forward optimization..."), profiled(profile=opt_profile):
+                    wf_df, wf_equity = run_walk_forward(
+                        Strategy, df_raw.set_index("Date"), cash, qty, strategy_params, train_bars, test_bars,
+                        anchored=anchored, engine=engine, workers=workers, search=search_mode, budget=budget
+                    )
+                with st.container(border=True):
+                    st.metric(label="OUT-OF-SAMPLE RETURN [%]", value=round((wf_equity["equity"].iloc[-1] / cash - 1) * 100, 2))
+                st.line_chart(wf_equity.set_index("Date")["equity"])
+                with st.expander("See Walk-forward Windows"):
+                    st.write(wf_df)
+
+            show_stage_timings(opt_profile)
 except (Exception) as e:
     st.error(f"{type(e).__name__} - {e}.")            
\ No newline at end of file
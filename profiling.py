@@ -0,0 +1,116 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+import pandas as pd
+
+#Per-stage timing for the backtest pipeline. Code marks its stages with
+#`with stage('name'):`; the marks cost a context-variable lookup unless a
+#Profile is active, e.g.
+#
+#   with profiled(memory=True) as profile:
+#       run_backtest(...)
+#   print(profile.format())
+#
+#Nested stages are recorded under their parent ("backtest > cerebro run").
+#Work done inside optimizer worker processes is not traced.
+
+_active = ContextVar('profile', default=None)
+
+
+class Profile(object):
+    """Inclusive wall time, call count and (with memory=True) the
+    tracemalloc peak above the stage's starting allocation, per stage path."""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.stages = {}
+        self.stack = []
+        self.started_tracing = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def enter(self, name):
+        path = self.stack[-1]['path'] + ' > ' + name if self.stack else name
+        self.stages.setdefault(path, {'stage': path, 'depth': path.count(' > '), 'seconds': 0.0, 'calls': 0, 'peak_mb': None})
+        frame = {'path': path, 'start': time.perf_counter(), 'child_peak': 0}
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                #Keep the parent's peak so far before the child resets it
+                self.stack[-1]['child_peak'] = max(self.stack[-1]['child_peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        self.stack.append(frame)
+
+    def exit(self):
+        frame = self.stack.pop()
+        seconds = time.perf_counter() - frame['start']
+        entry = self.stages[frame['path']]
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if self.memory:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            peak_mb = max(0, peak - frame['base']) / 1024 / 1024
+            entry['peak_mb'] = max(entry['peak_mb'] or 0.0, peak_mb)
+            if self.stack:
+                self.stack[-1]['child_peak'] = max(self.stack[-1]['child_peak'], peak)
+
+    def breakdown(self):
+        """Stage records in first-entered order: stage, depth, seconds,
+        calls, peak_mb."""
+        return [dict(entry) for entry in self.stages.values()]
+
+    def to_frame(self):
+        frame = pd.DataFrame(self.breakdown(), columns=['stage', 'depth', 'seconds', 'calls', 'peak_mb'])
+        total = frame.loc[frame['depth'] == 0, 'seconds'].sum()
+        frame['share [%]'] = frame['seconds'] / total * 100 if total else 0.0
+        return frame
+
+    def format(self):
+        lines = []
+        for entry in self.breakdown():
+            memory = f"  peak {entry['peak_mb']:.2f} MB" if entry['peak_mb'] is not None else ''
+            lines.append(f"{'  ' * entry['depth']}{entry['stage'].split(' > ')[-1]:<{32 - 2 * entry['depth']}} "
+                         f"{entry['seconds']:>9.4f}s  x{entry['calls']}{memory}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def profiled(memory=False, profile=None):
+    """Activate a Profile (a new one unless given) for the enclosed code."""
+    profile = profile if profile is not None else Profile(memory)
+    token = _active.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _active.reset(token)
+
+
+@contextmanager
+def stage(name):
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def current_profile():
+    return _active.get()
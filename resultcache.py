@@ -0,0 +1,95 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import pandas as pd
+
+#Process-wide cache for run_backtest outputs. Streamlit sessions share the
+#imported module, so identical backtests are computed once per server.
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get('BACKTEST_RESULT_CACHE_MB', 512)) * 1024 * 1024)
+
+
+def frame_fingerprint(df):
+    """Content hash of a DataFrame (values, index and column names)."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr(list(df.columns)).encode())
+    return digest.hexdigest()
+
+
+def result_nbytes(result):
+    nbytes = 0
+    for item in result:
+        if isinstance(item, pd.DataFrame):
+            nbytes += int(item.memory_usage(index=True, deep=True).sum())
+        else:
+            nbytes += len(repr(item))
+    return nbytes
+
+
+def copy_result(result):
+    """Callers (the chart in particular) add columns to the returned frames,
+    so every hit gets its own copies."""
+    return tuple(item.copy() if isinstance(item, pd.DataFrame) else item for item in result)
+
+
+class ResultCache(object):
+    """LRU cache bounded by an approximate memory budget. Concurrent
+    requests for a key that is still being computed wait for that result
+    instead of computing it again (single flight)."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy_result(self.entries[key][0])
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            return copy_result(future.result())
+
+        try:
+            result = compute()
+        except BaseException as e:
+            with self.lock:
+                self.pending.pop(key, None)
+            future.set_exception(e)
+            raise
+        nbytes = result_nbytes(result)
+        with self.lock:
+            self.pending.pop(key, None)
+            if nbytes <= self.max_bytes:
+                self.entries[key] = (result, nbytes)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.nbytes -= evicted
+        future.set_result(result)
+        return copy_result(result)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+RESULT_CACHE = ResultCache()
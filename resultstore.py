@@ -0,0 +1,116 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+from arrayfeed import OHLCV
+from datacache import DEFAULT_ROOT
+from timeframes import fingerprint
+
+#Persistent optimizer records. Every evaluated parameter combination is kept
+#in a local SQLite file keyed by (data window fingerprint, strategy, full
+#params, cash, qty, engine, risk-free rate), so a rerun or a widened range
+#only evaluates the combinations not seen before. The store is opt-in: pass
+#store=RESULT_STORE (or another ResultStore) to run_optimizer. Its file sits
+#next to the market data cache unless BACKTEST_RESULT_STORE names another path.
+
+DEFAULT_PATH = os.environ.get('BACKTEST_RESULT_STORE', os.path.join(os.path.dirname(os.path.normpath(DEFAULT_ROOT)), 'optimizer.sqlite'))
+#Bump when strategies or metrics change in a way that invalidates old records
+VERSION = 1
+#Keys per SELECT, under SQLite's bound-parameter limit
+LOOKUP_CHUNK = 500
+
+
+def data_key(data):
+    """Content fingerprint of the dates and OHLC of a date-indexed DataFrame
+    or OHLCV bundle; both forms of the same bars share one key."""
+    return fingerprint(data if isinstance(data, OHLCV) else OHLCV.from_frame(data))
+
+
+def plain(value):
+    """json.dumps default: NumPy scalars as the matching Python type, so a
+    stored int parameter comes back as an int."""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def record_key(data_fingerprint, Strategy, params, cash, qty, engine, riskfreerate):
+    key = [VERSION, data_fingerprint, Strategy.__module__, Strategy.__name__,
+           sorted((k, repr(v)) for k, v in params.items()), repr(cash), repr(qty), engine, repr(riskfreerate)]
+    return hashlib.blake2b(json.dumps(key).encode(), digest_size=16).hexdigest()
+
+
+class ResultStore(object):
+    """Optimizer records in SQLite. Connections are opened per call, so the
+    store can be shared by the threads of a Streamlit server."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        if not self.ready:
+            with self.lock:
+                if not self.ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    with sqlite3.connect(self.path, timeout=30) as conn:
+                        conn.execute('PRAGMA journal_mode=WAL')
+                        conn.execute('CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, record TEXT NOT NULL)')
+                    self.ready = True
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get_many(self, keys):
+        """{key: record} for the keys already stored."""
+        keys = list(keys)
+        found = {}
+        conn = self.connect()
+        try:
+            for i in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[i:i + LOOKUP_CHUNK]
+                rows = conn.execute(f"SELECT key, record FROM records WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, json.loads(record)) for key, record in rows)
+        finally:
+            conn.close()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, record) pairs in one transaction."""
+        items = [(key, json.dumps(record, default=plain)) for key, record in items]
+        if not items:
+            return
+        conn = self.connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO records (key, record) VALUES (?, ?)', items)
+        finally:
+            conn.close()
+
+    def __len__(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM records')
+        finally:
+            conn.close()
+
+
+#Nothing touches the disk until the store is first used
+RESULT_STORE = ResultStore()
@@ -0,0 +1,194 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import math
+import random
+
+#Parameter search strategies for backtest.run_optimizer. Each one works on
+#the discrete grid given by strategy_params and follows an ask/tell loop:
+#ask() returns a batch of parameter dicts plus the fraction of the data
+#(most recent bars) to evaluate them on, tell() receives the result records.
+#An empty batch ends the search.
+
+OBJECTIVE = 'returns (%)'
+
+
+def objective(record):
+    value = record.get(OBJECTIVE)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return float('-inf')
+    return value if not math.isnan(value) else float('-inf')
+
+
+class GridSearch(object):
+    """Exhaustive search over every combination, or over the first `budget`
+    of them in grid order."""
+
+    def __init__(self, strategy_params, budget=None):
+        self.keys = list(strategy_params.keys())
+        self.values = [list(v) for v in strategy_params.values()]
+        self.size = 1
+        for v in self.values:
+            self.size *= len(v)
+        self.budget = min(budget or self.size, self.size)
+        self.done = False
+
+    @property
+    def total(self):
+        """Number of full-data evaluations the search will report."""
+        return self.budget
+
+    def decode(self, index):
+        combo = {}
+        for key, values in zip(reversed(self.keys), reversed(self.values)):
+            index, i = divmod(index, len(values))
+            combo[key] = values[i]
+        return {key: combo[key] for key in self.keys}
+
+    def key_of(self, params):
+        return tuple(params[key] for key in self.keys)
+
+    def ask(self):
+        if self.done:
+            return [], 1.0
+        self.done = True
+        return [self.decode(i) for i in range(self.budget)], 1.0
+
+    def tell(self, records):
+        pass
+
+
+class RandomSearch(GridSearch):
+    """Uniform sample of `budget` distinct combinations (default: a quarter
+    of the grid)."""
+
+    def __init__(self, strategy_params, budget=None, seed=None):
+        super(RandomSearch, self).__init__(strategy_params, budget)
+        self.budget = min(budget or max(1, self.size // 4), self.size)
+        self.rng = random.Random(seed)
+
+    def ask(self):
+        if self.done:
+            return [], 1.0
+        self.done = True
+        return [self.decode(i) for i in self.rng.sample(range(self.size), self.budget)], 1.0
+
+
+class SuccessiveHalving(RandomSearch):
+    """Start `budget` candidates on the most recent 1/eta**rungs of the data,
+    keep the best 1/eta after each rung and grow the window by eta until the
+    survivors run on the full range."""
+
+    def __init__(self, strategy_params, budget=None, seed=None, eta=3, max_rungs=2):
+        super(SuccessiveHalving, self).__init__(strategy_params, budget, seed)
+        self.budget = min(budget or self.size, self.size)
+        self.eta = eta
+        self.rungs = max(0, min(max_rungs, int(math.log(self.budget, eta)) if self.budget > 1 else 0))
+        self.rung = 0
+        self.candidates = [self.decode(i) for i in self.rng.sample(range(self.size), self.budget)]
+
+    @property
+    def total(self):
+        return max(1, self.budget // self.eta ** self.rungs)
+
+    def ask(self):
+        if self.rung > self.rungs:
+            return [], 1.0
+        return self.candidates, float(self.eta) ** (self.rung - self.rungs)
+
+    def tell(self, records):
+        ranked = sorted(records, key=objective, reverse=True)
+        keep = max(1, len(self.candidates) // self.eta)
+        self.candidates = [{key: r['strategy'][key] for key in self.keys} for r in ranked[:keep]]
+        self.rung += 1
+
+
+class TPESearch(RandomSearch):
+    """Sequential model-based search (Tree-structured Parzen Estimator style).
+    After a random start-up batch, each parameter gets smoothed categorical
+    densities over the best `gamma` fraction of results and over the rest.
+    Candidates are drawn from the good density and the one with the highest
+    good/bad likelihood ratio is evaluated next."""
+
+    def __init__(self, strategy_params, budget=None, seed=None, batch_size=1, gamma=0.25, n_candidates=24):
+        super(TPESearch, self).__init__(strategy_params, budget, seed)
+        self.batch_size = max(1, batch_size)
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.n_startup = min(self.budget, max(5, self.budget // 5, self.batch_size))
+        self.history = []
+        self.seen = set()
+
+    def ask(self):
+        remaining = self.budget - len(self.seen)
+        if remaining <= 0:
+            return [], 1.0
+        if not self.history:
+            batch = [self.decode(i) for i in self.rng.sample(range(self.size), self.n_startup)]
+        else:
+            batch = self.suggest(min(self.batch_size, remaining))
+        self.seen.update(self.key_of(p) for p in batch)
+        return batch, 1.0
+
+    def tell(self, records):
+        self.history.extend((r['strategy'], objective(r)) for r in records)
+
+    def densities(self, observed):
+        result = []
+        for key, values in zip(self.keys, self.values):
+            counts = dict((v, 1.0) for v in values)
+            for params in observed:
+                if params[key] in counts:
+                    counts[params[key]] += 1.0
+            total = sum(counts.values())
+            result.append(dict((v, c / total) for v, c in counts.items()))
+        return result
+
+    def suggest(self, n):
+        ranked = sorted(self.history, key=lambda h: h[1], reverse=True)
+        n_good = max(1, int(math.ceil(self.gamma * len(ranked))))
+        good = self.densities([p for p, _ in ranked[:n_good]])
+        bad = self.densities([p for p, _ in ranked[n_good:]])
+
+        scored = {}
+        for _ in range(self.n_candidates * n):
+            params = {}
+            score = 0.0
+            for key, values, l, g in zip(self.keys, self.values, good, bad):
+                v = self.rng.choices(values, weights=[l[x] for x in values])[0]
+                params[key] = v
+                score += math.log(l[v]) - math.log(g[v])
+            k = self.key_of(params)
+            if k not in self.seen:
+                scored[k] = (score, params)
+        batch = [params for _, params in sorted(scored.values(), key=lambda s: s[0], reverse=True)[:n]]
+
+        #Fall back to unseen random points once the good region is exhausted
+        tries = 0
+        while len(batch) < n and tries < 100 * n:
+            params = self.decode(self.rng.randrange(self.size))
+            if self.key_of(params) not in self.seen and params not in batch:
+                batch.append(params)
+            tries += 1
+        return batch
+
+
+SEARCH_MODES = {
+    'grid': GridSearch,
+    'random': RandomSearch,
+    'halving': SuccessiveHalving,
+    'tpe': TPESearch,
+}
+
+
+def make_search(mode, strategy_params, budget=None, seed=None, batch_size=1):
+    """Search of the given mode. `seed` seeds the sampling modes and
+    `batch_size` sets the TPE batch; the grid only takes the budget."""
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {mode}. Expected one of {list(SEARCH_MODES)}.")
+    if mode == 'grid':
+        return GridSearch(strategy_params, budget=budget)
+    if mode == 'tpe':
+        return TPESearch(strategy_params, budget=budget, seed=seed, batch_size=batch_size)
+    return SEARCH_MODES[mode](strategy_params, budget=budget, seed=seed)
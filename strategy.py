@@ -1,12 +1,58 @@
 import backtrader as bt
-
-class StrategyRSI(bt.Strategy):
+import numpy as np
+import pandas as pd
+from timeframes import timeframe
+
+
+class RecordingStrategy(bt.Strategy):
+    """Base strategy that records the values passed to record() on every bar.
+    Subclasses name the recorded columns once in record_fields; the values go
+    into NumPy buffers preallocated from the data length in start()."""
+    record_fields = ()
+
+    def start(self):
+        n = max(self.data.buflen(), 1)
+        #Bar positions; dates come from the feed's int64 timestamps
+        self.recorded_rows = np.empty(n, dtype=np.int64)
+        self.recorded_values = np.full((n, len(self.record_fields)), np.nan)
+        self.recorded = 0
+
+    def record(self, *values):
+        i = self.recorded
+        if i == len(self.recorded_rows):
+            #Feeds that are not preloaded report a short buflen, grow as needed
+            self.recorded_rows = np.resize(self.recorded_rows, 2 * i)
+            self.recorded_values = np.concatenate([self.recorded_values, np.full_like(self.recorded_values, np.nan)])
+        self.recorded_rows[i] = len(self.data) - 1
+        #None (indicator not ready) is stored as NaN by the float buffer
+        self.recorded_values[i] = values
+        self.recorded = i + 1
+
+    def higher(self, rule, field='Close'):
+        """Value of the last completed higher-timeframe bar ('W', 'M', 'Q',
+        'Y') on the current bar: an OHLCV field or a pivot level such as
+        'support2'. NaN until the first higher bar completes. The bars come
+        from timeframes.TIMEFRAME_CACHE, aligned once per run."""
+        aligned = self.__dict__.setdefault('aligned', {})
+        values = aligned.get((rule, field))
+        if values is None:
+            values = aligned[(rule, field)] = timeframe(self.data.p.dataname, rule).column(field)
+        return values[len(self.data) - 1]
+
+    def indicators_frame(self):
+        """Recorded values as a DataFrame viewing the buffers (no copy)."""
+        n = self.recorded
+        frame = pd.DataFrame(self.recorded_values[:n], columns=list(self.record_fields), copy=False)
+        frame.insert(0, 'datetime', self.data.p.dataname.index[self.recorded_rows[:n]])
+        return frame
+
+
+class StrategyRSI(RecordingStrategy):
+    record_fields = ('rsi_val',)
     params = (('rsi_period', 14), ('rsi_lower', 30), ('rsi_upper', 70),)
 
     def __init__(self):
         self.rsi = bt.indicators.RelativeStrengthIndex(period=self.params.rsi_period)
-        self.indicator_values = []
-        self.indicator_headers = None
 
     def next(self):
         try:
@@ -14,13 +60,7 @@ class StrategyRSI(bt.Strategy):
         except:
             rsi_val = None
 
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [name for name in local_vars if name not in ('self', 'local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-        
-        self.indicator_values.append([self.data.datetime.datetime(0), rsi_val])
+        self.record(rsi_val)
 
         if not self.position:  # Not in the market
             if rsi_val is not None and rsi_val < self.params.rsi_lower:
@@ -30,7 +70,8 @@ class StrategyRSI(bt.Strategy):
                 self.sell()
 
 
-class StrategyMACross(bt.Strategy):
+class StrategyMACross(RecordingStrategy):
+    record_fields = ('fast_val', 'slow_val', 'cross_val')
     params = (('fast_ma', 10), ('slow_ma', 20))
 
     def __init__(self):
@@ -39,10 +80,6 @@ class StrategyMACross(bt.Strategy):
         self.slow = bt.indicators.SMA(self.data.close, period=self.params.slow_ma)
         self.crossover = bt.indicators.CrossOver(self.fast, self.slow)
 
-        # For logging indicator values
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             fast_val = self.fast[0]
@@ -51,20 +88,8 @@ class StrategyMACross(bt.Strategy):
         except:
             fast_val = slow_val = cross_val = None
 
-        # Header row
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [name for name in local_vars if name not in ('self', 'local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
         # Log values
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            fast_val,
-            slow_val,
-            cross_val
-        ])
+        self.record(fast_val, slow_val, cross_val)
 
         # --- Trading Logic ---
         if not self.position:
@@ -77,7 +102,8 @@ class StrategyMACross(bt.Strategy):
                 self.sell()
 
 
-class StrategySAR(bt.Strategy):
+class StrategySAR(RecordingStrategy):
+    record_fields = ('psar_val', 'close_val')
     params = (
         ('af', 0.02),    # Acceleration Factor
         ('afmax', 0.1),  # Maximum AF
@@ -90,10 +116,6 @@ class StrategySAR(bt.Strategy):
             afmax=self.params.afmax
         )
 
-        # For logging indicator values
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             psar_val = self.psar[0]
@@ -102,19 +124,8 @@ class StrategySAR(bt.Strategy):
             psar_val = None
             close_val = None
 
-        # Create header row once
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [name for name in local_vars if name not in ('self', 'local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
         # Log indicator values
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            psar_val,
-            close_val
-        ])
+        self.record(psar_val, close_val)
 
         # --- Trading Logic (Simple SAR Trend-Following) ---
 
@@ -131,7 +142,8 @@ class StrategySAR(bt.Strategy):
                     self.sell()
 
 
-class StrategyMACD(bt.Strategy):
+class StrategyMACD(RecordingStrategy):
+    record_fields = ('macd_val', 'signal_val', 'hist_val')
     params = (
         ('fast', 12),
         ('slow', 26),
@@ -152,9 +164,6 @@ class StrategyMACD(bt.Strategy):
         # Backtrader MACD has no .histo — compute manually
         self.hist = self.macd.macd - self.macd.signal
 
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             macd_val = self.macd_line[0]
@@ -163,18 +172,7 @@ class StrategyMACD(bt.Strategy):
         except:
             macd_val = signal_val = hist_val = None
 
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [v for v in local_vars if v not in ('self', 'local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            macd_val,
-            signal_val,
-            hist_val
-        ])
+        self.record(macd_val, signal_val, hist_val)
 
         # --- Simple MACD Trading Logic ---
         if not self.position:
@@ -185,7 +183,8 @@ class StrategyMACD(bt.Strategy):
                 self.sell()
 
 
-class StrategyBollinger(bt.Strategy):
+class StrategyBollinger(RecordingStrategy):
+    record_fields = ('mid', 'top', 'bot', 'close')
     params = (('period', 20), ('devfactor', 2.0),)
 
     def __init__(self):
@@ -197,9 +196,6 @@ class StrategyBollinger(bt.Strategy):
         self.top = self.bb.top
         self.bot = self.bb.bot
 
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             mid = float(self.mid[0])
@@ -209,17 +205,7 @@ class StrategyBollinger(bt.Strategy):
         except:
             mid = top = bot = close = None
 
-        # Store indicator values
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [n for n in local_vars if n not in ('self','local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            mid, top, bot, close,
-        ])
+        self.record(mid, top, bot, close)
 
         # --- Logic ---
         if not self.position:
@@ -230,31 +216,20 @@ class StrategyBollinger(bt.Strategy):
                 self.sell()
 
 
-class StrategyWilliamsR(bt.Strategy):
+class StrategyWilliamsR(RecordingStrategy):
+    record_fields = ('wr_val',)
     params = (('period', 14),)
 
     def __init__(self):
         self.wr = bt.indicators.WilliamsR(period=self.params.period)
 
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             wr_val = float(self.wr[0])
         except:
             wr_val = None
 
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [n for n in local_vars if n not in ('self','local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            wr_val
-        ])
+        self.record(wr_val)
 
         # --- Logic ---
         if not self.position:
@@ -265,7 +240,32 @@ class StrategyWilliamsR(bt.Strategy):
                 self.sell()
 
 
-class StrategyHarami(bt.Strategy):
+class StrategyPivot(RecordingStrategy):
+    """Breakout over the floor pivots of the last completed higher-timeframe
+    bar (weekly by default), read with higher()."""
+    record_fields = ('pp_val', 'resistance1_val', 'close')
+    params = (('rule', 'W'),)
+
+    def next(self):
+        pp_val = self.higher(self.params.rule, 'pp')
+        resistance1_val = self.higher(self.params.rule, 'resistance1')
+        close = self.data.close[0]
+
+        self.record(pp_val, resistance1_val, close)
+
+        # --- Logic ---
+        if np.isnan(pp_val):
+            return
+        if not self.position:
+            if close > resistance1_val:
+                self.buy()
+        else:
+            if close < pp_val:
+                self.sell()
+
+
+class StrategyHarami(RecordingStrategy):
+    record_fields = ('harami_val',)
     def __init__(self):
         # Returns +100 (bullish), -100 (bearish), 0 (none)
         self.harami = bt.talib.CDLHARAMI(
@@ -275,25 +275,13 @@ class StrategyHarami(bt.Strategy):
             self.data.close
         )
 
-        self.indicator_values = []
-        self.indicator_headers = None
-
     def next(self):
         try:
             harami_val = int(self.harami[0])
         except:
             harami_val = None
 
-        local_vars = locals()
-        if self.indicator_headers is None:
-            var_names = [n for n in local_vars if n not in ('self','local_vars')]
-            self.indicator_headers = ['datetime'] + var_names
-            self.indicator_values.append(self.indicator_headers)
-
-        self.indicator_values.append([
-            self.data.datetime.datetime(0),
-            harami_val
-        ])
+        self.record(harami_val)
 
         # --- Logic ---
         if not self.position:
@@ -0,0 +1,33 @@
+import numpy as np
+from ledger import match_trades_fifo
+
+
+def lots(amount, price):
+    trades = match_trades_fifo(amount, price, np.arange(len(amount)).astype('datetime64[D]'))
+    return [(round(float(size), 9), float(entry), float(exit_)) for size, entry, exit_ in
+            zip(trades['Size'], trades['EntryPrice'], trades['ExitPrice'])]
+
+
+def test_partial_exits_close_one_entry_in_two_lots():
+    assert lots([10, -5, -5], [100, 110, 120]) == [(5, 100, 110), (5, 100, 120)]
+
+
+def test_scale_in_closed_by_one_exit():
+    assert lots([10, 5, -15], [100, 90, 120]) == [(10, 100, 120), (5, 90, 120)]
+
+
+def test_trailing_open_entry_is_left_out():
+    assert lots([10, -10, 10], [100, 110, 105]) == [(10, 100, 110)]
+
+
+def test_mixed_partial_exit_and_scale_in():
+    assert lots([10, -4, 5, -11], [100, 110, 90, 120]) == [(4, 100, 110), (6, 100, 120), (5, 90, 120)]
+
+
+def test_float_sizes_leave_no_near_zero_lot():
+    #0.1 + 0.2 != 0.3 in floating point
+    assert lots([0.1, 0.2, -0.3, 1, -1], [100, 101, 110, 90, 95]) == [(0.1, 100, 110), (0.2, 101, 110), (1, 90, 95)]
+
+
+def test_no_fills():
+    assert lots([], []) == []
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+import strategy
+from backtest import daily_return, run_backtest
+from benchmark import synthetic_ohlcv
+from montecarlo import additive_metrics, compounded_metrics, trade_monte_carlo, trade_pnl
+
+CASH = 100000
+
+
+@pytest.fixture(scope='module')
+def backtest():
+    df = synthetic_ohlcv(2000, 0)
+    perf, trades, tx, _, timeret, _, _ = run_backtest(strategy.StrategyMACross, df, CASH, 10, False, False, cache=False)
+    return df, perf.set_index('metric')['value'], trades, tx, timeret
+
+
+def test_trade_path_reproduces_final_equity(backtest):
+    df, perf, trades, tx, _ = backtest
+    #Closed trades leave out the lot still open at the end, marked at the last close
+    open_qty = tx['amount'].sum()
+    open_value = open_qty * (df['Close'].iloc[-1] - tx.loc[tx['amount'] > 0, 'price'].iloc[-1]) if open_qty else 0.0
+    trade_final = additive_metrics(trade_pnl(trades)[None, :], CASH)[0][0]
+    assert trade_final + open_value == pytest.approx(perf['EQUITY FINAL [IDR]'], rel=1e-9)
+
+
+def test_return_path_reproduces_final_equity(backtest):
+    _, perf, _, _, timeret = backtest
+    steps = timeret['Value'].to_numpy(dtype=float)
+    final = compounded_metrics(np.log1p(steps)[None, :], (steps - daily_return)[None, :], CASH)[0][0]
+    assert final == pytest.approx(perf['EQUITY FINAL [IDR]'], rel=1e-9)
+
+
+def test_shuffle_keeps_the_trade_sum(backtest):
+    _, _, trades, _, _ = backtest
+    bands, samples = trade_monte_carlo(trades, CASH, paths=2000, method='shuffle', seed=0)
+    assert np.allclose(samples['final equity'], CASH + trade_pnl(trades).sum(), rtol=1e-9)
+    assert bands.loc['final equity', 'mean'] == pytest.approx(CASH + trade_pnl(trades).sum(), rel=1e-9)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+import strategy
+from arrayfeed import OHLCV
+from backtest import run_backtest
+from benchmark import synthetic_ohlcv
+from timeframes import TimeframeCache, add_levels, completed, resample, timeframe
+
+
+@pytest.fixture
+def df():
+    return synthetic_ohlcv(300, 1)
+
+
+def test_resample_aggregates_each_period(df):
+    monthly = resample(OHLCV.from_frame(df), 'M')
+    periods = df.index.to_period('M')
+    expected = df.groupby(periods).agg({'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'})
+    assert len(monthly) == len(expected)
+    for col in ('Open', 'High', 'Low', 'Close'):
+        np.testing.assert_allclose(monthly[col], expected[col].to_numpy())
+    #Stamped with the last base bar of each month
+    last_bars = df.index.to_series().groupby(periods).max()
+    assert (pd.DatetimeIndex(monthly.dates) == pd.DatetimeIndex(last_bars.to_numpy())).all()
+
+
+def test_last_period_is_never_completed(df):
+    bars = OHLCV.from_frame(df)
+    monthly = resample(bars, 'M')
+    positions = completed(bars.dates, monthly.dates)
+    #Bars of the first month see nothing, the last bar sees the month before its own
+    assert (positions[:np.searchsorted(bars.dates, monthly.dates[0])] == -1).all()
+    assert positions[-1] == len(monthly) - 2
+    #A month counts from the close of its last bar
+    last_of_first = np.searchsorted(bars.dates, monthly.dates[0])
+    assert positions[last_of_first] == 0 and positions[last_of_first - 1] == -1
+
+
+def test_higher_reads_the_last_completed_bar(df):
+    result = run_backtest(strategy.StrategyPivot, df, 1000000, 10, False, False, cache=False)
+    indicators = result[-1]
+    weekly = timeframe(df, 'W')
+    rows = df.index.get_indexer(pd.DatetimeIndex(indicators['datetime']))
+    np.testing.assert_array_equal(indicators['pp_val'].to_numpy(), weekly.column('pp')[rows])
+    np.testing.assert_array_equal(indicators['resistance1_val'].to_numpy(), weekly.column('resistance1')[rows])
+    assert not np.isnan(indicators['pp_val'].to_numpy()).all()
+
+
+def test_add_levels_names(df):
+    indicators = pd.DataFrame({'datetime': df.index, 'x': 1.0})
+    assert {'support2', 'resistance2'} <= set(add_levels(indicators, df, True).columns)
+    named = add_levels(indicators, df, ['W', 'M'])
+    assert {'support2_W', 'resistance2_W', 'support2_M', 'resistance2_M'} <= set(named.columns)
+    assert 'support2' not in named.columns
+
+
+def test_cache_keeps_a_running_size():
+    cache = TimeframeCache()
+    bars = [OHLCV.from_frame(synthetic_ohlcv(500, seed)) for seed in range(3)]
+    for b in bars:
+        cache.get(b, 'W').column('support2')
+    assert cache.nbytes == sum(entry.nbytes for entry in cache.entries.values())
+    cache.max_bytes = cache.nbytes - 1
+    cache.get(bars[0], 'M')
+    assert cache.nbytes == sum(entry.nbytes for entry in cache.entries.values()) <= cache.max_bytes
+    assert (bars[0].fingerprint, 'W') not in cache.entries
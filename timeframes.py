@@ -0,0 +1,182 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from arrayfeed import OHLCV
+from downsample import aggregate_ohlc
+
+#Higher-timeframe bars for multi-timeframe strategies. Weekly/monthly/...
+#bars are aggregated once per base series (keyed by its content) and kept
+#in TIMEFRAME_CACHE together with the position of the last completed higher
+#bar for every base bar, so reading a higher-timeframe value on a base bar is
+#an array lookup. A higher bar is stamped with its last base bar and counts
+#as completed from that bar's close on; earlier base bars see the previous one.
+#The last higher bar of a series never counts as completed: without a base bar
+#of the next period it may still be partial.
+
+#Period number of an int64 nanosecond timestamp, per rule
+RULES = {
+    #Weeks start on Monday; 1970-01-01 was a Thursday
+    'W': lambda dates: (dates // (86400 * 10**9) + 3) // 7,
+    'M': lambda dates: dates.view('datetime64[ns]').astype('datetime64[M]').astype(np.int64),
+    'Q': lambda dates: dates.view('datetime64[ns]').astype('datetime64[M]').astype(np.int64) // 3,
+    'Y': lambda dates: dates.view('datetime64[ns]').astype('datetime64[Y]').astype(np.int64),
+}
+#Levels added to the indicators frame when a backtest asks for higher timeframes
+LEVELS = ('support2', 'resistance2')
+
+
+def parse_rules(timeframes):
+    """True -> ('M',) (the former monthly resampling), a rule or a list of
+    rules -> tuple, falsy -> ()."""
+    if not timeframes:
+        return ()
+    if timeframes is True:
+        return ('M',)
+    rules = (timeframes,) if isinstance(timeframes, str) else tuple(timeframes)
+    for rule in rules:
+        if rule not in RULES:
+            raise ValueError(f'Unknown timeframe {rule}. Expected one of {list(RULES)}.')
+    return rules
+
+
+def resample(bars, rule):
+    """OHLCV bundle of `rule` bars, each stamped with its last base bar."""
+    dates = np.asarray(bars.dates, dtype=np.int64)
+    if not len(dates):
+        return OHLCV(dates, dict((k, np.asarray(v, dtype=np.float64)) for k, v in bars.columns.items()))
+    keys = RULES[rule](dates)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    ends = np.append(starts[1:], len(dates)) - 1
+    nan = np.full(len(dates), np.nan)
+    open_, high, low, close, volume = aggregate_ohlc(*(bars.columns.get(col, nan) for col in ('Open', 'High', 'Low', 'Close', 'Volume')), starts=starts)
+    columns = {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume}
+    return OHLCV(dates[ends], dict((col, np.asarray(columns[col], dtype=np.float64)) for col in bars.columns))
+
+
+def completed(base_dates, higher_dates):
+    """Position of the last completed higher bar per base date (-1 before
+    the first one). The last higher bar is left out since no bar of the
+    next period shows it is over."""
+    return np.searchsorted(np.asarray(higher_dates, dtype=np.int64)[:-1], np.asarray(base_dates, dtype=np.int64), side='right') - 1
+
+
+def take(values, positions):
+    """values[positions] with NaN where no higher bar has completed yet."""
+    out = np.asarray(values, dtype=np.float64)[np.maximum(positions, 0)] if len(values) else np.full(len(positions), np.nan)
+    out[positions < 0] = np.nan
+    return out
+
+
+def pivot_levels(bars):
+    """Classic floor pivots of every bar: pp, support1/2, resistance1/2."""
+    high, low, close = (np.asarray(bars[col], dtype=np.float64) for col in ('High', 'Low', 'Close'))
+    pp = (high + low + close) / 3.0
+    return {'pp': pp, 'support1': 2 * pp - high, 'resistance1': 2 * pp - low,
+            'support2': pp - (high - low), 'resistance2': pp + (high - low)}
+
+
+def fingerprint(bars):
+    """Content key of a bundle (dates and OHLC), computed once per bundle."""
+    key = getattr(bars, 'fingerprint', None)
+    if key is None:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(bars.dates, dtype=np.int64).view(np.uint8))
+        for col in ('Open', 'High', 'Low', 'Close'):
+            if col in bars.columns:
+                digest.update(np.ascontiguousarray(bars[col], dtype=np.float64).view(np.uint8))
+        key = bars.fingerprint = digest.hexdigest()
+    return key
+
+
+class Timeframe(object):
+    """Higher bars of one base series plus, per base bar, the position of
+    the last completed higher bar."""
+
+    def __init__(self, bars, positions, on_grow=None):
+        self.bars = bars
+        self.positions = positions
+        self.aligned = {}
+        #Called with the size of every aligned column added later
+        self.on_grow = on_grow
+        self.nbytes = positions.nbytes + sum(np.asarray(v).nbytes for v in bars.columns.values()) + np.asarray(bars.dates).nbytes
+
+    def column(self, name):
+        """A higher-bar field or pivot level aligned to the base bars."""
+        values = self.aligned.get(name)
+        if values is None:
+            source = self.bars[name] if name in self.bars.columns else pivot_levels(self.bars)[name]
+            values = self.aligned[name] = take(source, self.positions)
+            self.nbytes += values.nbytes
+            if self.on_grow is not None:
+                self.on_grow(values.nbytes)
+        return values
+
+
+class TimeframeCache(object):
+    """Timeframes by (base fingerprint, rule), bounded by `max_bytes` with
+    least-recently-used eviction like vectorized.IndicatorCache."""
+
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bars, rule):
+        key = (fingerprint(bars), rule)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        higher = resample(bars, rule)
+        timeframe = self.entries[key] = Timeframe(higher, completed(bars.dates, higher.dates), self.grow)
+        self.grow(timeframe.nbytes)
+        return timeframe
+
+    def grow(self, nbytes):
+        """Count nbytes more and evict least-recently-used entries while over
+        max_bytes (the most recent entry is always kept)."""
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            evicted.on_grow = None
+
+    def clear(self):
+        for entry in self.entries.values():
+            entry.on_grow = None
+        self.entries.clear()
+        self.nbytes = 0
+
+
+TIMEFRAME_CACHE = TimeframeCache()
+
+
+def timeframe(data, rule):
+    """Cached Timeframe of a date-indexed OHLCV DataFrame or bundle."""
+    return TIMEFRAME_CACHE.get(data if isinstance(data, OHLCV) else OHLCV.from_frame(data), rule)
+
+
+def add_levels(indicators_df, data, timeframes, levels=LEVELS):
+    """Indicators frame with the pivot levels of the last completed higher
+    bar of every rule, looked up by date. Columns are '<level>_<rule>'; with
+    timeframes=True (the former monthly resampling) they keep the plain
+    level names, 'support2' and 'resistance2'."""
+    rules = parse_rules(timeframes)
+    if not rules or not isinstance(indicators_df, pd.DataFrame) or 'datetime' not in indicators_df.columns:
+        return indicators_df
+    bars = data if isinstance(data, OHLCV) else OHLCV.from_frame(data)
+    dates = pd.DatetimeIndex(indicators_df['datetime']).values.astype('datetime64[ns]').view(np.int64)
+    rows = np.clip(np.searchsorted(np.asarray(bars.dates, dtype=np.int64), dates, side='right') - 1, 0, max(len(bars) - 1, 0))
+    indicators_df = indicators_df.copy()
+    for rule in rules:
+        tf = TIMEFRAME_CACHE.get(bars, rule)
+        for level in levels:
+            name = level if timeframes is True else f'{level}_{rule}'
+            indicators_df[name] = tf.column(level)[rows] if len(bars) else np.nan
+    return indicators_df
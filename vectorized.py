@@ -0,0 +1,282 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+import hashlib
+import math
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import strategy
+from metrics import bar_returns, day_values, drawdown_stats, sharpe_ratio, total_returns, trade_stats, sqn, calmar
+
+
+#Indicators, replicating backtrader's seeding so signals land on the same bars
+def sma(x, period):
+    return pd.Series(x).rolling(period).mean().to_numpy()
+
+
+def smoothing(x, period, alpha):
+    """Exponential smoothing seeded with the simple average of the first
+    `period` valid values, like backtrader's ExponentialSmoothing."""
+    out = np.full(len(x), np.nan)
+    valid = np.flatnonzero(~np.isnan(x))
+    if len(valid) == 0 or valid[0] + period > len(x):
+        return out
+    seed = valid[0] + period - 1
+    y = x[seed:].copy()
+    y[0] = math.fsum(x[valid[0]:seed + 1]) / period
+    out[seed:] = pd.Series(y).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return out
+
+
+def ema(x, period):
+    return smoothing(x, period, 2.0 / (1.0 + period))
+
+
+def rsi(close, period):
+    diff = np.diff(close, prepend=np.nan)
+    maup = smoothing(np.maximum(diff, 0.0), period, 1.0 / period)
+    madown = smoothing(np.maximum(-diff, 0.0), period, 1.0 / period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100.0 - 100.0 / (1.0 + maup / madown)
+
+
+def crossover(fast, slow):
+    d = fast - slow
+    valid = np.flatnonzero(~np.isnan(d))
+    out = np.full(len(d), np.nan)
+    if len(valid) == 0:
+        return out
+    #Last non-zero difference, seeded with the first raw difference
+    nzd = np.where(d != 0, d, np.nan)
+    nzd[valid[0]] = d[valid[0]]
+    nzd = pd.Series(nzd).ffill().to_numpy()
+    prev = np.concatenate(([np.nan], nzd[:-1]))
+    out[valid[0] + 1:] = (((fast > slow) & (prev < 0)).astype(float) - ((fast < slow) & (prev > 0)).astype(float))[valid[0] + 1:]
+    return out
+
+
+def psar(high, low, close, af, afmax):
+    """Parabolic SAR. Path dependent, so this is a plain loop over floats."""
+    n = len(close)
+    out = [float('nan')] * n
+    if n < 2:
+        return np.array(out)
+    high = high.tolist()
+    low = low.tolist()
+    sar = (high[1] + low[1]) / 2.0
+    if close[1] >= close[0]:
+        tr, ep = False, low[0]
+    else:
+        tr, ep = True, high[0]
+    acc = af
+    for i in range(1, n):
+        hi = high[i]
+        lo = low[i]
+        if (tr and sar >= lo) or (not tr and sar <= hi):
+            tr = not tr
+            sar = ep
+            ep = hi if tr else lo
+            acc = af
+        out[i] = sar
+        if tr:
+            if hi > ep:
+                ep = hi
+                acc = min(acc + af, afmax)
+        else:
+            if lo < ep:
+                ep = lo
+                acc = min(acc + af, afmax)
+        sar = sar + acc * (ep - sar)
+        if tr:
+            lo1 = low[i - 1]
+            if sar > lo or sar > lo1:
+                sar = min(lo, lo1)
+        else:
+            hi1 = high[i - 1]
+            if sar < hi or sar < hi1:
+                sar = max(hi, hi1)
+    return np.array(out)
+
+
+class IndicatorCache(object):
+    """Memoizes indicator arrays by (data fingerprint, indicator, params) so
+    optimizer combinations sharing a period compute it once. Bounded by
+    `max_bytes` with least-recently-used eviction."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, *args):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        value = compute(*args)
+        self.entries[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+INDICATOR_CACHE = IndicatorCache()
+
+
+def prepare(df):
+    """OHLC arrays plus a content fingerprint identifying the data window."""
+    data = dict((k, np.asarray(df[col], dtype=float)) for k, col in (('o', 'Open'), ('h', 'High'), ('l', 'Low'), ('c', 'Close')))
+    digest = hashlib.blake2b(digest_size=16)
+    for k in ('o', 'h', 'l', 'c'):
+        digest.update(np.ascontiguousarray(data[k]).view(np.uint8))
+    data['key'] = digest.hexdigest()
+    return data
+
+
+def cached(d, name, params, compute, *args):
+    return INDICATOR_CACHE.get((d['key'], name, params), compute, *args)
+
+
+def macd_line(c, fast, slow):
+    return ema(c, fast) - ema(c, slow)
+
+
+#Strategy rules: recorded indicators (same names as strategy.py) plus entry/exit signals
+def signals_rsi(d, p):
+    rsi_val = cached(d, 'rsi', (p['rsi_period'],), rsi, d['c'], p['rsi_period'])
+    return {'rsi_val': rsi_val}, rsi_val < p['rsi_lower'], rsi_val > p['rsi_upper']
+
+
+def signals_macross(d, p):
+    fast_val = cached(d, 'sma', (p['fast_ma'],), sma, d['c'], p['fast_ma'])
+    slow_val = cached(d, 'sma', (p['slow_ma'],), sma, d['c'], p['slow_ma'])
+    cross_val = crossover(fast_val, slow_val)
+    return {'fast_val': fast_val, 'slow_val': slow_val, 'cross_val': cross_val}, cross_val > 0, cross_val < 0
+
+
+def signals_sar(d, p):
+    psar_val = cached(d, 'psar', (p['af'], p['afmax']), psar, d['h'], d['l'], d['c'], p['af'], p['afmax'])
+    return {'psar_val': psar_val, 'close_val': d['c']}, d['c'] > psar_val, d['c'] < psar_val
+
+
+def signals_macd(d, p):
+    macd_val = cached(d, 'macd', (p['fast'], p['slow']), macd_line, d['c'], p['fast'], p['slow'])
+    signal_val = ema(macd_val, p['signal'])
+    hist_val = macd_val - signal_val
+    return {'macd_val': macd_val, 'signal_val': signal_val, 'hist_val': hist_val}, hist_val > 0, hist_val < 0
+
+
+SIGNALS = {
+    strategy.StrategyRSI: signals_rsi,
+    strategy.StrategyMACross: signals_macross,
+    strategy.StrategySAR: signals_sar,
+    strategy.StrategyMACD: signals_macd,
+}
+
+
+def supports(Strategy):
+    return Strategy in SIGNALS
+
+
+def simulate(o, c, entry, exit_, cash, qty):
+    """Long-only, fixed-stake fills: a signal on bar t fills at the open of
+    bar t+1. Returns None when a buy would not be affordable, since the
+    backtrader broker would reject it and the paths diverge."""
+    n = len(c)
+    state = pd.Series(np.where(entry, 1.0, np.where(exit_, 0.0, np.nan))).ffill().fillna(0.0).to_numpy()
+    change = np.diff(state, prepend=0.0)
+    orders = np.flatnonzero(change[:n - 1])
+    fill_idx = orders + 1
+    amount = (change[orders] * qty).astype(np.int64)
+    price = o[fill_idx]
+
+    cash_after = cash - np.cumsum(amount * price)
+    cash_before = np.concatenate(([cash], cash_after[:-1]))
+    buys = amount > 0
+    if np.any(cash_before[buys] < qty * np.maximum(price[buys], c[orders][buys])):
+        return None
+
+    flows = np.zeros(n)
+    np.add.at(flows, fill_idx, amount * price)
+    size = np.zeros(n, dtype=np.int64)
+    np.add.at(size, fill_idx, amount)
+    size = np.cumsum(size)
+    value = cash - np.cumsum(flows) + size * c
+    return fill_idx, amount, price, size, value
+
+
+def run_strategy(Strategy, df, cash, qty, params, riskfreerate):
+    """Fast-path equivalent of the cerebro run in backtest.run_backtest for
+    the strategies in SIGNALS. Returns None when the run cannot be modeled."""
+    d = prepare(df)
+    o, c = d['o'], d['c']
+    indicators, entry, exit_ = SIGNALS[Strategy](d, params)
+    sim = simulate(o, c, entry, exit_, cash, qty)
+    if sim is None:
+        return None
+    fill_idx, amount, price, size, value = sim
+    dates = pd.DatetimeIndex(df.index)
+
+    timereturn = bar_returns(value, cash)
+    daily = day_values(dates, value)
+    trades, pnl, _ = trade_stats(fill_idx, amount, price)
+
+    start = max(np.flatnonzero(~np.isnan(v))[0] if (~np.isnan(v)).any() else len(c) for v in indicators.values())
+    indicators_df = pd.DataFrame({'datetime': dates[start:], **{k: v[start:] for k, v in indicators.items()}}).dropna(axis=1, how='all')
+
+    transaction_df = pd.DataFrame({'date': dates[fill_idx], 'amount': amount, 'price': price, 'sid': 0, 'symbol': '', 'value': -amount * price})
+    transaction_df['signal'] = np.where(transaction_df['amount'] < 0, 'sell', 'buy')
+    position_df = pd.DataFrame({'index': dates, 'Value': size * c})
+    calmar_val = calmar(dates, value, cash)
+
+    return {
+        'sharpe': sharpe_ratio(bar_returns(daily, cash), riskfreerate),
+        'drawdown': drawdown_stats(value),
+        'returns': total_returns(daily, cash),
+        'trades': trades,
+        'sqn': sqn(pnl),
+        'equity': {'dates': dates, 'value': value, 'fill_idx': fill_idx, 'amount': amount, 'price': price},
+        'value': float(value[-1]),
+        'indicators_df': indicators_df,
+        'timereturn_df': pd.DataFrame({'Date': dates, 'Value': timereturn}),
+        'calmar_df': pd.DataFrame({'index': list(calmar_val.keys()), 'Value': list(calmar_val.values())}),
+        'transaction_df': transaction_df,
+        'position_df': position_df,
+    }
+
+
+def equity(Strategy, df, cash, qty, params):
+    """Broker value per bar for one parameter combination, or None when
+    the run cannot be modeled."""
+    d = prepare(df)
+    indicators, entry, exit_ = SIGNALS[Strategy](d, params)
+    sim = simulate(d['o'], d['c'], entry, exit_, cash, qty)
+    return None if sim is None else sim[-1]
+
+
+def evaluate(Strategy, df, cash, qty, params, riskfreerate):
+    """Slim optimizer record for one parameter combination, matching the
+    fields collected by backtest.run_optimizer. Returns None when the
+    combination cannot be modeled."""
+    d = prepare(df)
+    indicators, entry, exit_ = SIGNALS[Strategy](d, params)
+    sim = simulate(d['o'], d['c'], entry, exit_, cash, qty)
+    if sim is None:
+        return None
+    value = sim[-1]
+    timereturn = bar_returns(value, cash)
+    return {
+        'strategy': params,
+        'sharpe_ratio': sharpe_ratio(timereturn, riskfreerate)['sharperatio'],
+        'returns (%)': total_returns(value, cash)['rtot'] * 100,
+        'max_drawdown (%)': drawdown_stats(value)['max']['drawdown'],
+    }